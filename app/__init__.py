@@ -1,7 +1,16 @@
 from app.routes import home, dashboard, api
+from os import getenv
 from flask import Flask
 from app.db import init_db
 from app.utils import filters
+from app.commands import register_commands
+from app.utils.ranking import start_decay_worker
+from app.utils.cache import init_cache
+from app.utils.votes import init_votes
+from app.utils.events import init_events
+from app.utils import passwords
+from app.utils.metrics import init_metrics
+from app.utils.admission import init_admission
 
 # We use a `from...import` statement to import the `Flask()` function and then use the def keyword to define a `create_app()` function.
 def create_app(test_config=None):
@@ -9,9 +18,70 @@ def create_app(test_config=None):
   app = Flask(__name__, static_url_path='/')
   app.url_map.strict_slashes = False
   app.config.from_mapping(
-    SECRET_KEY='super_secret_key'
+    SECRET_KEY='super_secret_key',
+    # create any missing tables when the app starts (handy for a fresh local database). DB_CREATE_ALL=0 in the environment
+    # skips it, so starting a worker makes no database round-trips; run `flask migrate` when deploying instead
+    DB_CREATE_ALL=getenv('DB_CREATE_ALL', '1') == '1',
+    # the hot ranking is re-decayed by `flask decay-scores`, run from cron every ten minutes or so. A number of seconds here starts
+    # a background thread doing it instead, in every process that creates the app (each worker and each `flask` command), so only
+    # set it where there's a single long-running process
+    HOT_DECAY_INTERVAL=0,
+    # rendered post-info fragments: 'lru' (in-process), 'shared' (Redis at FRAGMENT_CACHE_URL, or a local stand-in) or None to disable
+    FRAGMENT_CACHE_BACKEND='lru',
+    FRAGMENT_CACHE_SIZE=10000,
+    FRAGMENT_CACHE_URL=None,
+    FRAGMENT_CACHE_TTL=3600,
+    # assembled single-post pages (post, author, comments): entries kept in-process and their lifetime in seconds
+    POST_VIEW_CACHE_SIZE=1000,
+    POST_VIEW_CACHE_TTL=60,
+    # queue upvotes in memory and write them in batches instead of one INSERT + commit per click
+    VOTE_WRITE_BEHIND=False,
+    VOTE_BATCH_SIZE=500,
+    VOTE_FLUSH_INTERVAL=1.0,
+    # largest list the /batch API routes accept in one request
+    BATCH_MAX_SIZE=1000,
+    # largest page the JSON read routes (GET /api/posts, GET /api/posts/<id>/comments) return in one response
+    API_PAGE_MAX_SIZE=1000,
+    # bcrypt cost for new hashes (older hashes are upgraded on login), and the worker processes that compute them
+    BCRYPT_ROUNDS=12,
+    PASSWORD_HASH_WORKERS=2,
+    PASSWORD_HASH_MAX_PENDING=64,
+    # requests running more SQL statements than this are logged and counted at /metrics (None disables the check).
+    # The single-item write routes run a fixed dozen or so (the row, its counters, score, search terms and version stamps), however
+    # large the data; the /batch routes stay in that range too, since each step is one set-based statement for the whole batch
+    QUERY_BUDGET=15,
+    # send X-DB-* timing headers on every response even outside debug mode
+    SQL_METRICS_HEADERS=False,
+    # how long shared caches may keep pages served to anonymous visitors; logged-in pages are always revalidated
+    ANONYMOUS_MAX_AGE=5,
+    # live updates at /api/events, off unless LIVE_UPDATES is on. Every open stream holds a worker thread for as long as the page
+    # stays open, so EVENTS_MAX_SUBSCRIBERS has to stay well below the server's worker threads; past it, new streams get a 503.
+    # Then: events buffered per subscriber before it's told to reload, how long to gather a burst of writes into one batch,
+    # and seconds between keepalives
+    LIVE_UPDATES=False,
+    EVENTS_MAX_SUBSCRIBERS=8,
+    EVENTS_BUFFER_SIZE=100,
+    EVENTS_COALESCE_SECONDS=0.25,
+    EVENTS_KEEPALIVE=15,
+    # concurrent requests and queue length per route class (see app/utils/admission.py). The concurrency limits are each class's
+    # share of the connection pool: they're scaled at startup to add up to DB_POOL_SIZE, so no class can take every connection.
+    # None turns admission control off
+    ADMISSION_LIMITS={
+      'feed': (8, 32),
+      'post': (6, 24),
+      'write': (4, 32),
+      'auth': (2, 16)
+    },
+    # longest a request waits in its class's queue before it's turned away with a 503
+    ADMISSION_QUEUE_TIMEOUT=2.0,
+    # per-user token bucket for the api write routes: sustained writes a second and how many can be saved up for a burst (None disables)
+    WRITE_RATE=5,
+    WRITE_BURST=30
   )
 
+  if test_config is not None:
+    app.config.from_mapping(test_config)
+
   @app.route('/hello')
   def hello():
     return 'hello world'
@@ -21,11 +91,30 @@ def create_app(test_config=None):
   app.register_blueprint(dashboard)
 
   init_db(app)
+  init_metrics(app)
+  init_admission(app)
 
   app.jinja_env.filters['format_url'] = filters.format_url
   app.jinja_env.filters['format_date'] = filters.format_date
   app.jinja_env.filters['format_plural'] = filters.format_plural
 
+  init_cache(app)
+
+  passwords.configure(
+    rounds=app.config['BCRYPT_ROUNDS'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_MAX_PENDING']
+  )
+
   app.register_blueprint(api)
 
+  register_commands(app)
+
+  init_votes(app)
+
+  init_events(app)
+
+  if app.config['HOT_DECAY_INTERVAL']:
+    start_decay_worker(app.config['HOT_DECAY_INTERVAL'])
+
   return app
\ No newline at end of file
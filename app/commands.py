@@ -0,0 +1,140 @@
+import sys
+import click
+from sqlalchemy.exc import IntegrityError
+from app.db import Session, engine
+from app.utils.counters import reconcile_counts
+from app.utils.ranking import decay_scores
+from app.utils.backup import open_backup, export_tables, import_tables
+from app.utils.search import rebuild_index
+from app.utils.domains import backfill_domains
+from app.utils.votes import dedupe_votes
+from app.utils import schema
+
+# maintenance commands that run through the Flask CLI, for example `flask reconcile-counts`.
+# create_app() registers them on the app, so they share its database settings
+def register_commands(app):
+
+  # recompute every post's stored vote and comment counts from the votes and comments tables
+  @app.cli.command('reconcile-counts')
+  @click.option('--chunk-size', default=10000, show_default=True, help='Posts to repair per transaction.')
+  def reconcile_counts_command(chunk_size):
+    db = Session()
+    try:
+      updated = reconcile_counts(db, chunk_size=chunk_size)
+    finally:
+      db.close()
+
+    click.echo('Reconciled counters for {} posts'.format(updated))
+
+  # recompute the hot ranking of recent posts and retire old ones; safe to run from cron alongside the background worker
+  @app.cli.command('decay-scores')
+  def decay_scores_command():
+    db = Session()
+    try:
+      updated = decay_scores(db)
+    finally:
+      db.close()
+
+    click.echo('Re-decayed hot scores for {} posts'.format(updated))
+
+  # stream users, posts, comments and votes to an NDJSON file (gzipped when PATH ends in .gz, or - for stdout)
+  @app.cli.command('export')
+  @click.argument('path')
+  @click.option('--gzip/--no-gzip', 'compress', default=None, help='Compress the output (default: when PATH ends in .gz).')
+  @click.option('--chunk-size', default=10000, show_default=True, help='Rows fetched from the database at a time.')
+  def export_command(path, compress, chunk_size):
+    with open_backup(path, 'w', compress) as out:
+      written = export_tables(out, chunk_size=chunk_size)
+
+    click.echo(', '.join('{} {}'.format(count, name) for name, count in written.items()), err=True)
+
+  # load a file written by `flask export`; re-running after an interruption resumes from PATH.checkpoint
+  @app.cli.command('import')
+  @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+  @click.option('--gzip/--no-gzip', 'compress', default=None, help='Read a compressed file (default: when PATH ends in .gz).')
+  @click.option('--chunk-size', default=10000, show_default=True, help='Rows per INSERT and commit.')
+  @click.option('--restart', is_flag=True, help='Ignore any checkpoint and start from the first line.')
+  def import_command(path, compress, chunk_size, restart):
+    inserted = import_tables(path, chunk_size=chunk_size, compress=compress, resume=not restart)
+
+    click.echo('Imported ' + ', '.join('{} {}'.format(count, name) for name, count in inserted.items()))
+    click.echo('Run `flask rebuild-search-index` to make the imported posts searchable')
+
+  # store the domain of every post written before posts kept one
+  @app.cli.command('backfill-domains')
+  @click.option('--chunk-size', default=10000, show_default=True, help='Posts to update per transaction.')
+  def backfill_domains_command(chunk_size):
+    db = Session()
+    try:
+      updated = backfill_domains(db, chunk_size=chunk_size)
+    finally:
+      db.close()
+
+    click.echo('Filled in the domain of {} posts'.format(updated))
+
+  # recompute the search index from every post title and comment
+  @app.cli.command('rebuild-search-index')
+  @click.option('--chunk-size', default=1000, show_default=True, help='Posts to index per transaction.')
+  def rebuild_search_index_command(chunk_size):
+    db = Session()
+    try:
+      indexed = rebuild_index(db, chunk_size=chunk_size)
+    finally:
+      db.close()
+
+    click.echo('Indexed {} posts'.format(indexed))
+
+
+  # delete repeated votes left over from before votes were unique per user and post, then repair the counters they inflated.
+  # Run it before `flask migrate` adds the unique constraint to an existing votes table
+  @app.cli.command('dedupe-votes')
+  @click.option('--chunk-size', default=1000, show_default=True, help='Duplicated (user, post) pairs to clean up per transaction.')
+  def dedupe_votes_command(chunk_size):
+    db = Session()
+    try:
+      deleted = dedupe_votes(db, chunk_size=chunk_size)
+      updated = reconcile_counts(db) if deleted else 0
+    finally:
+      db.close()
+
+    click.echo('Deleted {} duplicate votes, reconciled counters for {} posts'.format(deleted, updated))
+
+  # bring the database up to the models: create missing tables, columns and indexes, then record the schema fingerprint.
+  # Run it when deploying, so workers can start with DB_CREATE_ALL=0
+  @app.cli.command('migrate')
+  @click.option('--dry-run', is_flag=True, help='Only list what would be changed.')
+  def migrate_command(dry_run):
+    try:
+      applied, manual = schema.migrate(engine, dry_run=dry_run)
+    except IntegrityError as e:
+      # adding a unique constraint to a table that already holds duplicates. Steps applied before it stay applied
+      # where the database can't roll DDL back, which is fine: running migrate again carries on from there
+      click.echo('Could not apply the schema, the table has rows that break it: {}'.format(e.orig))
+      click.echo('Remove the duplicate rows (`flask dedupe-votes` for votes) and run `flask migrate` again')
+      sys.exit(1)
+
+    for step in applied:
+      click.echo(('would ' if dry_run else '') + step)
+    for step in manual:
+      click.echo(step)
+
+    if manual:
+      click.echo('{} difference(s) need a manual change; no fingerprint recorded'.format(len(manual)))
+      sys.exit(1)
+
+    click.echo('Schema is up to date' if not applied else '{} change(s) {}'.format(len(applied), 'pending' if dry_run else 'applied'))
+
+  # exits with status 1 when the database doesn't match the models; a database migrated to the current models is confirmed without inspecting it
+  @app.cli.command('verify-schema')
+  @click.option('--deep', is_flag=True, help='Inspect the database even when the stored fingerprint matches.')
+  def verify_schema_command(deep):
+    ok, problems = schema.verify(engine, deep=deep)
+
+    for problem in problems:
+      click.echo(problem)
+
+    if not ok:
+      click.echo('Schema does not match the models; run `flask migrate`')
+      sys.exit(1)
+
+    click.echo('Schema matches the models (fingerprint {})'.format(schema.fingerprint(engine)[:12]))
@@ -2,12 +2,17 @@
     # The engine variable manages the overall connection to the database.
     # The Session variable generates temporary connections for performing create, read, update, and delete (CRUD) operations.
     # The Base class variable helps us map the models to real MySQL tables.
+import itertools
+import threading
+import time
+from functools import wraps
 from os import getenv
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
-from flask import g
+from flask import g, session
 
 load_dotenv()
 
@@ -15,26 +20,130 @@ load_dotenv()
 # Note that the getenv() function is part of Python's built-in os module. 
 # But because we used a .env file to fake the environment variable, we need to first call load_dotenv() from the python-dotenv module. 
 # In production, DB_URL will be a proper environment variable.
-engine = create_engine(getenv('DB_URL'), echo=True, pool_size=20, max_overflow=0)
+# SQLite (handy for local datasets and benchmarks) doesn't use a connection queue, so the pool settings only apply to real database servers.
+# They come from DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds to wait for a free connection) and DB_POOL_PRE_PING=1
+# (test each connection before handing it out, so a restarted database doesn't surface as errors).
+# Statement logging is off unless DB_ECHO=1: echoing every statement synchronously is far too slow for production.
+# Per-request query counts and timings come from app/utils/metrics.py instead
+def engine_options(url):
+  options = {
+    'echo': getenv('DB_ECHO') == '1',
+    'pool_pre_ping': getenv('DB_POOL_PRE_PING') == '1'
+  }
+
+  if not url.startswith('sqlite'):
+    options.update(
+      pool_size=int(getenv('DB_POOL_SIZE', '20')),
+      max_overflow=int(getenv('DB_MAX_OVERFLOW', '0')),
+      pool_timeout=float(getenv('DB_POOL_TIMEOUT', '30'))
+    )
+
+  return options
+
+engine = create_engine(getenv('DB_URL'), **engine_options(getenv('DB_URL')))
 Session = sessionmaker(bind=engine)
 Base = declarative_base()
 
+# Read replicas: REPLICA_URLS is a comma-separated list of database URLs that receive the primary's data.
+# Routes decorated with @read_only run their queries on one of them, picked by REPLICA_STRATEGY:
+# 'round_robin' (the default) or 'least_busy' (fewest connections checked out right now).
+# A user who just wrote something reads from the primary for REPLICA_STICKY_SECONDS afterwards,
+# so they always see their own post, comment or vote even if the replicas lag a little behind.
+# The shared post view cache honours this too: its entries are checked against the post's version stamp (app/utils/post_views.py)
+replicas = [
+  create_engine(url.strip(), **engine_options(url.strip()))
+  for url in (getenv('REPLICA_URLS') or '').split(',') if url.strip()
+]
+replica_strategy = getenv('REPLICA_STRATEGY', 'round_robin')
+replica_sticky_seconds = float(getenv('REPLICA_STICKY_SECONDS', '5'))
+
+_next_replica = itertools.cycle(range(len(replicas))) if replicas else None
+_next_replica_lock = threading.Lock()
+
+# (name, engine) for the primary and every replica, for metrics and tooling
+def all_engines():
+  return [('primary', engine)] + [('replica{}'.format(i), replica) for i, replica in enumerate(replicas)]
+
+def pick_replica():
+  if replica_strategy == 'least_busy' and all(hasattr(replica.pool, 'checkedout') for replica in replicas):
+    return min(replicas, key=lambda replica: replica.pool.checkedout())
+
+  with _next_replica_lock:
+    return replicas[next(_next_replica)]
+
+# builds an INSERT that silently skips rows violating a unique constraint, in whatever spelling the session's database understands
+def insert_ignore(db, table):
+  dialect = db.get_bind().dialect.name
+
+  if dialect == 'sqlite':
+    return sqlite.insert(table).on_conflict_do_nothing()
+  if dialect == 'postgresql':
+    return postgresql.insert(table).on_conflict_do_nothing()
+  if dialect == 'mysql':
+    return mysql.insert(table).prefix_with('IGNORE')
+
+  return table.insert()
+
+# decorator for routes that only read, in the same spirit as login_required
+def read_only(func):
+  @wraps(func)
+  def wrapped_function(*args, **kwargs):
+    g.read_only = True
+    return func(*args, **kwargs)
+
+  return wrapped_function
+
+def _choose_engine():
+  if not replicas or not g.get('read_only'):
+    return engine
+
+  # read-your-writes: this user wrote recently, so the replicas might not have their change yet
+  last_write = session.get('last_write_at')
+  if last_write is not None and time.time() - last_write < replica_sticky_seconds:
+    return engine
+
+  return pick_replica()
+
+# a session that ran an INSERT, UPDATE or DELETE is marked, so the request can remember when this user last wrote
+@event.listens_for(Session, 'after_flush')
+def _mark_flush(db, flush_context):
+  db.info['wrote'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _mark_write(orm_execute_state):
+  if not orm_execute_state.is_select:
+    orm_execute_state.session.info['wrote'] = True
+
+def _remember_write(response):
+  db = g.get('db')
+
+  if db is not None and db.info.get('wrote') and replicas:
+    session['last_write_at'] = time.time()
+
+  return response
+
 # We're using the same Base.metadata.create_all() method from the seeds.py file, but we won't call it until after we've called init_db(). 
 # So when would be a good time to call init_db()? When the Flask app is ready!
+# Creating missing tables costs a round-trip per table on every process start, so deployments that scale workers up and down
+# turn it off (DB_CREATE_ALL=0) and manage the schema with `flask migrate` / `flask verify-schema` instead (see app/utils/schema.py).
+# Then creating the app never touches the database; the first connection is opened by the first request that needs one
 def init_db(app):
-  Base.metadata.create_all(engine)
+  if app.config['DB_CREATE_ALL']:
+    Base.metadata.create_all(engine)
     # Now Flask will run close_db() together with its built-in teardown_appcontext() method. 
     # Note that we added app as a parameter of the init_db() function. We need to make sure that the variable gets passed in correctly.
   app.teardown_appcontext(close_db)
+  app.after_request(_remember_write)
 
 # Whenever this function is called, it returns a new session-connection object. 
 # Other modules in the app can import Session directly from the db package, but using a function means that we can perform additional logic before creating the database connection.
 # get_db() function now saves the current connection on the g object, if it's not already there. 
 # Then it returns the connection from the g object instead of creating a new Session instance each time.
+# That additional logic is picking the database: the primary, or a replica for @read_only routes.
 def get_db():
   if 'db' not in g:
     # store db connection in app context
-    g.db = Session()
+    g.db = Session(bind=_choose_engine())
 
   return g.db
 # For instance, if get_db() is called twice in the same route, we won't want to create a second connection. Rather, it will make more sense to return the existing connection.
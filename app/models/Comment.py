@@ -1,6 +1,6 @@
 from datetime import datetime
 from app.db import Base
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 
 # comment model includes a dynamic property for user, meaning that a query for a comment should also return information about its author
@@ -14,4 +14,9 @@ class Comment(Base):
   created_at = Column(DateTime, default=datetime.now)
   updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
-  user = relationship('User')
\ No newline at end of file
+  user = relationship('User')
+
+  # a post's comments are read one page at a time, oldest or newest first by (created_at, id), so this index makes each page a short range scan
+  __table_args__ = (
+    Index('ix_comments_post_id_created_at_id', 'post_id', 'created_at', 'id'),
+  )
\ No newline at end of file
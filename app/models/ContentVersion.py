@@ -0,0 +1,13 @@
+from datetime import datetime
+from app.db import Base
+from sqlalchemy import Column, Integer, String, DateTime
+
+# cheap version stamps for conditional GETs: one row for the whole feed ('global') and one per post ('post:<id>').
+# The write routes bump them in the same transaction as their change (see app/utils/versions.py), and the feed and post pages
+# turn them into ETag and Last-Modified headers, so a client that already has the current page gets a 304 without us building it again
+class ContentVersion(Base):
+  __tablename__ = 'content_versions'
+  key = Column(String(50), primary_key=True)
+  version = Column(Integer, nullable=False, default=0)
+  # kept in UTC, because it goes straight into Last-Modified headers
+  updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,33 +1,56 @@
 # import statements
 from datetime import datetime
 from app.db import Base
-from .Vote import Vote
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, select, func
-from sqlalchemy.orm import relationship, column_property
+from sqlalchemy import Column, Integer, Float, String, ForeignKey, DateTime, Index
+from sqlalchemy.orm import relationship, validates
+from app.utils.filters import url_domain
 
 # post class - SQLAlchemy models as Python classes
 class Post(Base):
   __tablename__ = 'posts'
   id = Column(Integer, primary_key=True)
   title = Column(String(100), nullable=False)
-  post_url = Column(String(100), nullable=False)
+  # long enough for real-world links with tracking parameters
+  post_url = Column(String(2048), nullable=False)
+  # the linked site, derived from post_url when it's set (see validate_post_url() and url_domain() in app/utils/filters.py)
+  domain = Column(String(255))
   user_id = Column(Integer, ForeignKey('users.id'))
   created_at = Column(DateTime, default=datetime.now)
   updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
   user = relationship('User')
-  comments = relationship('Comment', cascade='all,delete')
+  comments = relationship('Comment', cascade='all,delete', order_by='Comment.created_at')
   votes = relationship('Vote', cascade='all,delete')
   # Post model now has two defined relationships: one for users and one for comments
   # Querying for a post returns both data subsets
   # the model for comments also defines a relationship, querying for a post returns the comment-to-user subset as well
 
-  # query the model, this dynamic property will perform a SELECT, together with the SQLAlchemy func.count() method, to add up the votes
-  vote_count = column_property(
-    select([func.count(Vote.id)]).where(Vote.post_id == id)
+  # vote and comment totals are stored on the post itself instead of being counted on every read.
+  # The write routes bump them in the same transaction as the vote or comment they add (see app/utils/counters.py),
+  # and `flask reconcile-counts` recomputes them from the votes and comments tables if they ever drift
+  vote_count = Column(Integer, nullable=False, default=0, server_default='0', index=True)
+  comment_count = Column(Integer, nullable=False, default=0, server_default='0', index=True)
+
+  # precomputed "hot" ranking score, kept up to date by the vote and comment routes and re-decayed periodically (see app/utils/ranking.py)
+  hot_score = Column(Float, nullable=False, default=0, server_default='0')
+
+  # the feeds page through posts newest-first by (created_at, id) or best-first by (hot_score, id), so these indexes turn each page into a short range scan
+  __table_args__ = (
+    Index('ix_posts_created_at_id', 'created_at', 'id'),
+    Index('ix_posts_hot_score_id', 'hot_score', 'id'),
+    Index('ix_posts_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    # the /from/<domain> feed pages through one site's posts newest-first
+    Index('ix_posts_domain_created_at_id', 'domain', 'created_at', 'id'),
   )
+
+  # every time post_url is set, store its domain along with it
+  @validates('post_url')
+  def validate_post_url(self, key, post_url):
+    self.domain = url_domain(post_url)
+
+    return post_url
   
 # note the user_id field that we define as a ForeignKey that references the users table. 
 # also add created_at and updated_at fields that use Python's built-in datetime module to generate the timestamps.
 
-# Post model includes a dynamic property for votes, meaning that a query for a post should also return information about the number of votes the post has. 
+# Post model includes stored counters for votes and comments, meaning that a query for a post also returns the number of votes and comments the post has. 
 # We also want to make sure that when we delete a post from the database, every vote associated is subsequently deleted
\ No newline at end of file
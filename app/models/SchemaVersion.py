@@ -0,0 +1,11 @@
+from datetime import datetime
+from app.db import Base
+from sqlalchemy import Column, Integer, String, DateTime
+
+# a row per `flask migrate`, recording the fingerprint of the models the database was brought up to (see app/utils/schema.py).
+# `flask verify-schema` compares the latest one with the models' fingerprint, so checking an up-to-date database takes one query
+class SchemaVersion(Base):
+  __tablename__ = 'schema_versions'
+  id = Column(Integer, primary_key=True)
+  fingerprint = Column(String(64), nullable=False)
+  migrated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,16 @@
+from app.db import Base
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+
+# the search index: one row per (term, post) saying how strongly the post matches the term.
+# A word in the title counts TITLE_WEIGHT times, a word in one of its comments counts once (see app/utils/search.py).
+# The primary key starts with the term, so looking up every post that contains a word is one index range scan
+class SearchTerm(Base):
+  __tablename__ = 'search_terms'
+  term = Column(String(50), primary_key=True)
+  post_id = Column(Integer, ForeignKey('posts.id'), primary_key=True)
+  weight = Column(Integer, nullable=False, default=0)
+
+  __table_args__ = (
+    # deleting a post removes its rows by post_id
+    Index('ix_search_terms_post_id', 'post_id'),
+  )
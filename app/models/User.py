@@ -1,11 +1,11 @@
 # import statement
 from app.db import Base
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, DateTime
 from sqlalchemy.orm import validates
-import bcrypt
+from app.utils.passwords import hash_password, check_password
 
-# want to directly use the bcrypt module, so this time, the import syntax differs a bit. The first thing we need to do is create a salt to hash passwords against.
-salt = bcrypt.gensalt()
+# passwords are hashed with bcrypt, but the actual work happens in app/utils/passwords.py:
+# every hash gets its own salt, and the hashing runs in a pool of worker processes instead of on the request thread
 # created a User class that inherits from the Base class
 # earlier, we created Base as part of the db package. In the User class, we declare several properties that the parent Base class will use to make the table. 
 # use classes from the sqlalchemy module to define the table columns and their data types
@@ -16,6 +16,12 @@ class User(Base):
   username = Column(String(50), nullable=False)
   email = Column(String(50), nullable=False, unique=True)
   password = Column(String(100), nullable=False)
+  # dashboard totals, kept up to date by the write routes the same way as the post counters (see app/utils/counters.py):
+  # how many posts the user has, the votes and comments those posts received, and when the user last posted, commented or voted
+  post_count = Column(Integer, nullable=False, default=0, server_default='0')
+  votes_received = Column(Integer, nullable=False, default=0, server_default='0')
+  comments_received = Column(Integer, nullable=False, default=0, server_default='0')
+  last_active_at = Column(DateTime)
     # add a new validate_email() method to the class that a @validates('email') decorator wraps
     # validate_email() method returns what the value of the email column should be, and the @validates() decorator internally handles the rest
     # This decorator is similar to the @bp.routes() decorator that we used previously to handle the route functions
@@ -36,11 +42,8 @@ class User(Base):
 
     # encrypt password
     # validate_password() function now returns an encrypted version of the password, if the assert doesn't throw an error.
-    return bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hash_password(password)
 
-  # uses the checkpw() method to compare the incoming password (that is, the password parameter) to the one saved on the User object (self.password)
+  # compares the incoming password (that is, the password parameter) to the hash saved on the User object (self.password)
   def verify_password(self, password):
-    return bcrypt.checkpw(
-      password.encode('utf-8'),
-      self.password.encode('utf-8')
-    )
\ No newline at end of file
+    return check_password(password, self.password)
\ No newline at end of file
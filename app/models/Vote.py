@@ -1,9 +1,14 @@
 from app.db import Base
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, UniqueConstraint
 
 # the Post model will be counting the votes
 class Vote(Base):
   __tablename__ = 'votes'
   id = Column(Integer, primary_key=True)
   user_id = Column(Integer, ForeignKey('users.id'))
-  post_id = Column(Integer, ForeignKey('posts.id'))
\ No newline at end of file
+  post_id = Column(Integer, ForeignKey('posts.id'), index=True)
+
+  # a user can only upvote a post once. The upvote route inserts with "ignore duplicates" semantics, so repeat clicks are harmless
+  __table_args__ = (
+    UniqueConstraint('user_id', 'post_id', name='uq_votes_user_id_post_id'),
+  )
\ No newline at end of file
@@ -2,4 +2,7 @@
 from .User import User
 from .Post import Post
 from .Comment import Comment
-from .Vote import Vote
\ No newline at end of file
+from .Vote import Vote
+from .ContentVersion import ContentVersion
+from .SearchTerm import SearchTerm
+from .SchemaVersion import SchemaVersion
\ No newline at end of file
@@ -1,8 +1,20 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app, Response
 from app.models import User, Post, Comment, Vote
-from app.db import get_db
+from app.db import get_db, read_only
 import sys
+from collections import Counter
+from sqlalchemy.orm import joinedload
 from app.utils.auth import login_required
+from app.utils import counters, ranking, versions, search, events
+from app.utils.cache import invalidate_post
+from app.utils.post_views import COMMENT_PAGE_SIZE, COMMENT_SORT, COMMENT_ORDERS
+from app.utils.votes import record_vote, insert_votes, get_vote_queue
+from app.utils import passwords
+from app.utils.passwords import PasswordQueueFull, needs_rehash
+from app.utils.streaming import select_fields, page_limit, stream_page
+from app.utils.http_cache import conditional, feed_keys, post_keys
+from app.utils.filters import url_domain
+from app.routes.home import FEED_SORTS
 
 # define all the API endpoints for the app
 bp = Blueprint('api', __name__, url_prefix='/api')
@@ -27,6 +39,9 @@ def signup():
     # these changes, we use the db.add() method to prep the INSERT statement and the db.commit() method to officially update the database
     db.add(newUser)
     db.commit()
+  except PasswordQueueFull:
+    # the password couldn't even be hashed, so nothing was added; the client can simply try again
+    return jsonify(message = 'Too many signups, try again shortly'), 503
   except:
     # insert failed, so send error to front end
     print(sys.exe_info()[0])
@@ -66,8 +81,21 @@ def login():
   # Note that data['password'] becomes the second parameter in the verify_password() method of the class, because the first parameter is reserved for self
   # login() route will return a 400 status code if the posted email can't be found or if the posted password doesn't match. 
   # If neither happens, we can safely assume that the credentials are correct and thus create the session.
-  if user.verify_password(data['password']) == False:
-    return jsonify(message = 'Incorrect credentials'), 400
+  try:
+    if user.verify_password(data['password']) == False:
+      return jsonify(message = 'Incorrect credentials'), 400
+  except PasswordQueueFull:
+    return jsonify(message = 'Too many logins, try again shortly'), 503
+
+  # if the password was hashed with a different bcrypt cost than the one configured now, store a fresh hash while we still have the plain password.
+  # Failing to do so isn't worth failing the login over
+  if needs_rehash(user.password):
+    try:
+      user.password = data['password']
+      db.commit()
+    except:
+      print(sys.exc_info()[0])
+      db.rollback()
 
   # following code to create the session and send back a valid response
   session.clear()
@@ -97,31 +125,54 @@ def comment():
     )
 
     db.add(newComment)
+    # bump the post's stored comment count in the same transaction as the comment itself
+    counters.add_comment(db, data['post_id'])
+    counters.add_comments_received(db, { data['post_id']: 1 })
+    counters.touch_users(db, [session.get('user_id')])
+    search.index_comment(db, data['post_id'], data['comment_text'])
+    ranking.update_score(db, data['post_id'])
+    versions.bump(db, [data['post_id']])
     db.commit()
   except:
     print(sys.exc_info()[0])
 
     db.rollback()
     return jsonify(message = 'Comment failed'), 500
-  
+
+  invalidate_post(data['post_id'])
+  events.publish_counts(db, [data['post_id']])
+  events.publish_comments(db, [newComment.id])
+
   return jsonify(id = newComment.id)
 
 
 # An upvote creates a new record in the votes table, but the Post model ultimately uses that information. We'll thus define this action as a PUT route for posts.
+# Upvoting is idempotent: a second upvote of the same post by the same user changes nothing.
+# In write-behind mode the vote is only queued here and written in bulk by the vote queue (see app/utils/votes.py), so we answer 202 Accepted
 @bp.route('/posts/upvote', methods=['PUT'])
 @login_required
 def upvote():
   data = request.get_json()
+
+  try:
+    post_id = int(data['post_id'])
+  except:
+    return jsonify(message = 'Upvote failed'), 400
+
+  queue = get_vote_queue()
+  if queue is not None:
+    # a primary key lookup, so a vote for a post that doesn't exist gets a 404 now instead of a 202 that the flush will drop
+    if get_db().query(Post.id).filter(Post.id == post_id).first() is None:
+      return jsonify(message = 'Post not found'), 404
+
+    queue.add(session.get('user_id'), post_id)
+    return '', 202
+
   db = get_db()
 
   try:
     # create a new vote with incoming id and session id
-    newVote = Vote(
-      post_id = data['post_id'],
-      user_id = session.get('user_id')
-    )
-
-    db.add(newVote)
+    recorded = record_vote(db, session.get('user_id'), post_id)
     db.commit()
   except:
     print(sys.exc_info()[0])
@@ -129,6 +180,10 @@ def upvote():
     db.rollback()
     return jsonify(message = 'Upvote failed'), 500
 
+  if recorded:
+    invalidate_post(post_id)
+    events.publish_counts(db, [post_id])
+
   return '', 204
 
 # route for creating new posts—a process that closely follows the one that we created for new comments and upvotes
@@ -147,6 +202,11 @@ def create():
     )
 
     db.add(newPost)
+    # flush() sends the INSERT so the new post has an id to file its title's words under
+    db.flush()
+    search.index_post(db, newPost.id, newPost.title)
+    counters.add_posts(db, session.get('user_id'))
+    versions.bump(db)
     db.commit()
   except:
     print(sys.exc_info()[0])
@@ -154,6 +214,8 @@ def create():
     db.rollback()
     return jsonify(message = 'Post failed'), 500
 
+  events.publish_created(newPost.id, newPost.title, newPost.post_url)
+
   return jsonify(id = newPost.id)
 
 
@@ -168,7 +230,10 @@ def update(id):
   try:
     # retrieve post and update title property
     post = db.query(Post).filter(Post.id == id).one()
+    search.reindex_title(db, post.id, post.title, data['title'])
     post.title = data['title']
+    counters.touch_users(db, [session.get('user_id')])
+    versions.bump(db, [post.id])
     db.commit()
   except:
     print(sys.exc_info()[0])
@@ -176,6 +241,8 @@ def update(id):
     db.rollback()
     return jsonify(message = 'Post not found'), 404
 
+  invalidate_post(id)
+
   return '', 204
 
 
@@ -188,12 +255,423 @@ def delete(id):
 
   try:
     # delete post from db
-    db.delete(db.query(Post).filter(Post.id == id).one())
+    # the post's comments and votes go first, as bulk DELETEs in the same transaction, so we don't have to load every child row
+    # just to let the relationship cascade delete it. The post's counters disappear together with the post
+    post = db.query(Post).filter(Post.id == id).one()
+    db.query(Comment).filter(Comment.post_id == post.id).delete(synchronize_session=False)
+    db.query(Vote).filter(Vote.post_id == post.id).delete(synchronize_session=False)
+    search.unindex_post(db, post.id)
+    counters.remove_post(db, post)
+    db.delete(post)
+    versions.bump(db, [post.id])
+    db.commit()
+  except:
+    print(sys.exc_info()[0])
+
+    db.rollback()
+    return jsonify(message = 'Post not found'), 404
+
+  invalidate_post(id)
+  events.publish_deleted(int(id))
+
+  return '', 204
+
+# Batch variants of the write routes, for importers and moderation tools that would otherwise make thousands of round-trips.
+# Each takes a JSON list of objects (at most BATCH_MAX_SIZE of them), validates every item, writes all the valid ones
+# with a single executemany INSERT in one transaction, and answers with one result per item, in order.
+# Where the driver can return rows from an executemany (psycopg2), each created result also carries its new id.
+def get_batch():
+  items = request.get_json()
+
+  if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+    return None, (jsonify(message = 'Expected a list of objects'), 400)
+
+  if len(items) > current_app.config['BATCH_MAX_SIZE']:
+    return None, (jsonify(message = 'Batch too large'), 413)
+
+  return items, None
+
+def invalid(index, message):
+  return { 'index': index, 'status': 'invalid', 'message': message }
+
+def is_text(value, max_length):
+  return isinstance(value, str) and 0 < len(value.strip()) and len(value) <= max_length
+
+# look up which of the given post ids exist, in one query
+def existing_post_ids(db, items):
+  ids = set()
+  for item in items:
+    try:
+      ids.add(int(item.get('post_id')))
+    except (TypeError, ValueError):
+      pass
+
+  if not ids:
+    return set()
+
+  return { row.id for row in db.query(Post.id).filter(Post.id.in_(ids)) }
+
+# one executemany INSERT of `rows` into `table`. Returns the new ids in the order of `rows` when the driver can hand them back
+# with RETURNING, and None when it can't (SQLite and MySQL), rather than guessing them
+def insert_rows(db, table, rows):
+  if getattr(db.get_bind().dialect, 'insert_executemany_returning', False):
+    return [row[0] for row in db.execute(table.insert().returning(table.c.id), rows)]
+
+  db.execute(table.insert(), rows)
+  return None
+
+@bp.route('/posts/batch', methods=['POST'])
+@login_required
+def create_batch():
+  items, error = get_batch()
+  if error:
+    return error
+
+  db = get_db()
+  results = []
+  rows = []
+  created = []
+
+  for index, item in enumerate(items):
+    if not is_text(item.get('title'), 100):
+      results.append(invalid(index, 'title is required and must be at most 100 characters'))
+    elif not is_text(item.get('post_url'), 2048):
+      results.append(invalid(index, 'post_url is required and must be at most 2048 characters'))
+    else:
+      results.append({ 'index': index, 'status': 'created' })
+      rows.append({
+        'title': item['title'],
+        'post_url': item['post_url'],
+        # a Core INSERT skips the model's validator, so the domain is filled in here
+        'domain': url_domain(item['post_url']),
+        'user_id': session.get('user_id')
+      })
+
+  try:
+    if rows:
+      ids = insert_rows(db, Post.__table__, rows)
+
+      if ids is not None:
+        created = [(post_id, row['title'], row['post_url']) for post_id, row in zip(ids, rows)]
+        for result, post_id in zip([result for result in results if result['status'] == 'created'], ids):
+          result['id'] = post_id
+      else:
+        # without RETURNING, this user's newest posts, read in the same transaction. SQLite lets one writer in at a time,
+        # so nothing else can have been inserted since our INSERT
+        created = db.query(Post.id, Post.title, Post.post_url).filter(Post.user_id == session.get('user_id')).order_by(
+          Post.id.desc()
+        ).limit(len(rows)).all()
+
+      search.index_terms(db, { post_id: search.title_terms(title) for post_id, title, _ in created })
+      counters.add_posts(db, session.get('user_id'), len(rows))
+      versions.bump(db)
+    db.commit()
+  except:
+    print(sys.exc_info()[0])
+
+    db.rollback()
+    return jsonify(message = 'Post batch failed'), 500
+
+  for post_id, title, post_url in sorted(created):
+    events.publish_created(post_id, title, post_url)
+
+  return jsonify(results = results)
+
+@bp.route('/comments/batch', methods=['POST'])
+@login_required
+def comment_batch():
+  items, error = get_batch()
+  if error:
+    return error
+
+  db = get_db()
+  post_ids = existing_post_ids(db, items)
+  results = []
+  rows = []
+  counts = {}
+  terms = {}
+
+  for index, item in enumerate(items):
+    if not is_text(item.get('comment_text'), 255):
+      results.append(invalid(index, 'comment_text is required and must be at most 255 characters'))
+      continue
+
+    try:
+      post_id = int(item.get('post_id'))
+    except (TypeError, ValueError):
+      post_id = None
+
+    if post_id not in post_ids:
+      results.append(invalid(index, 'post not found'))
+      continue
+
+    results.append({ 'index': index, 'status': 'created' })
+    rows.append({
+      'comment_text': item['comment_text'],
+      'post_id': post_id,
+      'user_id': session.get('user_id')
+    })
+    counts[post_id] = counts.get(post_id, 0) + 1
+    terms.setdefault(post_id, Counter()).update(search.comment_terms(item['comment_text']))
+
+  try:
+    if rows:
+      ids = insert_rows(db, Comment.__table__, rows)
+      if ids is not None:
+        for result, comment_id in zip([result for result in results if result['status'] == 'created'], ids):
+          result['id'] = comment_id
+      counters.add_comments(db, counts)
+      counters.add_comments_received(db, counts)
+      counters.touch_users(db, [session.get('user_id')])
+      search.index_terms(db, terms)
+      ranking.update_scores(db, list(counts))
+      versions.bump(db, counts)
     db.commit()
   except:
     print(sys.exc_info()[0])
 
     db.rollback()
+    return jsonify(message = 'Comment batch failed'), 500
+
+  for post_id in counts:
+    invalidate_post(post_id)
+  events.publish_counts(db, list(counts))
+
+  return jsonify(results = results)
+
+@bp.route('/posts/upvote/batch', methods=['PUT'])
+@login_required
+def upvote_batch():
+  items, error = get_batch()
+  if error:
+    return error
+
+  db = get_db()
+  user_id = session.get('user_id')
+  post_ids = existing_post_ids(db, items)
+
+  # votes this user already has on these posts are reported as duplicates instead of being inserted again
+  voted = {
+    row.post_id for row in
+    db.query(Vote.post_id).filter(Vote.user_id == user_id, Vote.post_id.in_(post_ids))
+  } if post_ids else set()
+
+  results = []
+  pairs = []
+
+  for index, item in enumerate(items):
+    try:
+      post_id = int(item.get('post_id'))
+    except (TypeError, ValueError):
+      post_id = None
+
+    if post_id not in post_ids:
+      results.append(invalid(index, 'post not found'))
+    elif post_id in voted:
+      results.append({ 'index': index, 'status': 'duplicate' })
+    else:
+      results.append({ 'index': index, 'status': 'created' })
+      voted.add(post_id)
+      pairs.append((user_id, post_id))
+
+  upvoted = [post_id for _, post_id in pairs]
+
+  try:
+    if pairs:
+      insert_votes(db, pairs)
+      counters.recount_votes(db, upvoted)
+      counters.recount_authors(db, upvoted)
+      counters.touch_users(db, [user_id])
+      ranking.update_scores(db, upvoted)
+      versions.bump(db, upvoted)
+    db.commit()
+  except:
+    print(sys.exc_info()[0])
+
+    db.rollback()
+    return jsonify(message = 'Upvote batch failed'), 500
+
+  for post_id in upvoted:
+    invalidate_post(post_id)
+  events.publish_counts(db, upvoted)
+
+  return jsonify(results = results)
+
+# Read routes for the mobile client and partner integrations, so nobody has to scrape the rendered HTML.
+# Both return one cursor-paginated page (?after=, ?limit=) of only the columns named in ?fields=, streamed as it's read.
+# Like the pages they mirror, they run on a read replica when there is one and answer conditional GETs from the version stamps.
+POST_FIELDS = {
+  'id': Post.id,
+  'title': Post.title,
+  'post_url': Post.post_url,
+  'domain': Post.domain,
+  'user_id': Post.user_id,
+  'username': User.username,
+  'vote_count': Post.vote_count,
+  'comment_count': Post.comment_count,
+  'hot_score': Post.hot_score,
+  'created_at': Post.created_at,
+  'updated_at': Post.updated_at
+}
+POST_DEFAULT_FIELDS = ['id', 'title', 'post_url', 'domain', 'username', 'vote_count', 'comment_count', 'created_at']
+
+COMMENT_FIELDS = {
+  'id': Comment.id,
+  'comment_text': Comment.comment_text,
+  'post_id': Comment.post_id,
+  'user_id': Comment.user_id,
+  'username': User.username,
+  'created_at': Comment.created_at,
+  'updated_at': Comment.updated_at
+}
+COMMENT_DEFAULT_FIELDS = ['id', 'comment_text', 'username', 'created_at']
+
+@bp.route('/posts', methods=['GET'])
+@read_only
+@conditional(feed_keys)
+def posts():
+  db = get_db()
+  sort = request.args.get('sort', 'new')
+
+  if sort not in FEED_SORTS:
+    return jsonify(message = 'Unknown sort: {}'.format(sort)), 400
+
+  try:
+    fields = select_fields(POST_FIELDS, POST_DEFAULT_FIELDS)
+
+    def query(columns):
+      query = db.query(*columns).select_from(Post)
+      # ?domain= narrows the feed to one site, the same as the /from/<domain> page
+      if request.args.get('domain'):
+        query = query.filter(Post.domain == request.args['domain'].lower())
+      # the author's name is the only field that needs a join, so only join when it was asked for
+      if 'username' in fields:
+        query = query.join(User, Post.user_id == User.id)
+      return query
+
+    return stream_page(
+      'posts', query, POST_FIELDS, fields, FEED_SORTS[sort],
+      after=request.args.get('after'),
+      limit=page_limit()
+    )
+  except ValueError as e:
+    return jsonify(message = str(e)), 400
+
+@bp.route('/posts/<int:id>/comments', methods=['GET'])
+@read_only
+@conditional(post_keys)
+def post_comments(id):
+  db = get_db()
+
+  # ?order=oldest|newest, the same orderings (and cursors) as the comments on the single-post page
+  order = request.args.get('order', 'oldest')
+
+  if order not in COMMENT_ORDERS:
+    return jsonify(message = 'Unknown order: {}'.format(order)), 400
+
+  if db.query(Post.id).filter(Post.id == id).first() is None:
     return jsonify(message = 'Post not found'), 404
 
-  return '', 204
\ No newline at end of file
+  try:
+    fields = select_fields(COMMENT_FIELDS, COMMENT_DEFAULT_FIELDS)
+
+    def query(columns):
+      query = db.query(*columns).select_from(Comment).filter(Comment.post_id == id)
+      if 'username' in fields:
+        query = query.join(User, Comment.user_id == User.id)
+      return query
+
+    return stream_page(
+      'comments', query, COMMENT_FIELDS, fields, COMMENT_SORT,
+      after=request.args.get('after'),
+      limit=page_limit(COMMENT_PAGE_SIZE),
+      descending=COMMENT_ORDERS[order]
+    )
+  except ValueError as e:
+    return jsonify(message = str(e)), 400
+
+# ranked search over post titles and comments; ?q= is the query, and ?after= the cursor from the previous page
+@bp.route('/search')
+@read_only
+@conditional(feed_keys)
+def search_posts():
+  db = get_db()
+
+  try:
+    posts, scores, next_cursor = search.search(
+      db,
+      request.args.get('q', ''),
+      after=request.args.get('after'),
+      limit=page_limit(),
+      options=[joinedload(Post.user)]
+    )
+  except ValueError as e:
+    return jsonify(message = str(e)), 400
+
+  return jsonify(
+    posts = [
+      {
+        'id': post.id,
+        'title': post.title,
+        'post_url': post.post_url,
+        'domain': post.domain,
+        'username': post.user.username,
+        'vote_count': post.vote_count,
+        'comment_count': post.comment_count,
+        'created_at': post.created_at.isoformat(),
+        'score': scores[post.id]
+      }
+      for post in posts
+    ],
+    next_cursor = next_cursor
+  )
+
+# Live updates as server-sent events (see app/utils/events.py). ?posts=1,2,3 follows just those posts, and ?created=1
+# adds new posts to them (on its own, it follows only new posts); with neither the stream covers the whole feed
+@bp.route('/events')
+def live_events():
+  hub = events.get_hub()
+  new_posts = request.args.get('created') == '1'
+  post_ids = set() if new_posts else None
+
+  # live updates are turned off
+  if hub is None:
+    return jsonify(message = 'Live updates are not enabled'), 404
+
+  if request.args.get('posts'):
+    try:
+      post_ids = { int(post_id) for post_id in request.args['posts'].split(',') }
+    except ValueError:
+      return jsonify(message = 'Invalid post ids'), 400
+
+  subscriber = hub.subscribe(post_ids, new_posts=new_posts)
+
+  if subscriber is None:
+    response = jsonify(message = 'Too many live connections, try again shortly')
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+  response = Response(
+    events.stream(hub, subscriber, current_app.config['EVENTS_COALESCE_SECONDS'], current_app.config['EVENTS_KEEPALIVE']),
+    mimetype='text/event-stream'
+  )
+  response.headers['Cache-Control'] = 'no-cache'
+  # stop nginx from buffering the stream
+  response.headers['X-Accel-Buffering'] = 'no'
+
+  return response
+
+# runtime statistics: hit/miss counters for the rendered post fragment cache, the password hashing pool's queue depth and latency,
+# and the live update hub's subscribers
+@bp.route('/stats')
+def stats():
+  cache = current_app.extensions.get('fragment_cache')
+
+  hub = events.get_hub()
+
+  return jsonify(
+    fragment_cache = cache.stats() if cache is not None else None,
+    passwords = passwords.stats(),
+    events = hub.stats() if hub is not None else None
+  )
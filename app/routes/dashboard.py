@@ -1,6 +1,10 @@
-from flask import Blueprint, render_template, session
-from app.models import Post
-from app.db import get_db
+from flask import Blueprint, render_template, session, request, abort
+from sqlalchemy.orm import joinedload
+from app.models import User, Post
+from app.db import get_db, read_only
+from app.utils.feed import paginate
+from app.utils.post_views import get_post_view
+from app.utils.http_cache import conditional, feed_keys
 from app.utils.auth import login_required
 
 # using the url_prefix argument, we prefix every route in the blueprint with /dashboard. 
@@ -9,22 +13,37 @@ bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
 @bp.route('/')
 @login_required
+@read_only
+@conditional(feed_keys)
 def dash():
 
   # lengthy query is more readable when broken up into multiple lines, but to do so, we have to wrap the query in parentheses. 
   # Remember that Python cares about spacing. 
   # Without the parentheses, this would throw an indentation error
   db = get_db()
-  posts = (
-    db.query(Post)
-    .filter(Post.user_id == session.get('user_id'))
-    .order_by(Post.created_at.desc())
-    .all()
+
+  # the dashboard pages through the user's posts with the same cursor as the homepage
+  try:
+    posts, next_cursor = paginate(
+      db.query(Post).options(joinedload(Post.user)).filter(Post.user_id == session.get('user_id')),
+      [Post.created_at, Post.id],
+      after=request.args.get('after')
+    )
+  except ValueError:
+    abort(400)
+
+  # the user's totals are stored on their row, so the summary costs one primary-key lookup however many posts they have
+  stats = (
+    db.query(User.post_count, User.votes_received, User.comments_received, User.last_active_at)
+    .filter(User.id == session.get('user_id'))
+    .one()
   )
 
   return render_template(
     'dashboard.html',
     posts=posts,
+    stats=stats,
+    next_cursor=next_cursor,
     loggedIn=session.get('loggedIn')
   )
 
@@ -34,7 +53,11 @@ def dash():
 def edit(id):
   # get single post by id
   db = get_db()
-  post = db.query(Post).filter(Post.id == id).one()
+  # the post, its author and the first page of its comments come from the post view cache, or are loaded in two eager queries on a miss
+  try:
+    post = get_post_view(db, id, order=request.args.get('order', 'oldest'), after=request.args.get('after'))
+  except (KeyError, ValueError):
+    abort(400)
 
   # render edit page
   return render_template(
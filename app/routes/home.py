@@ -1,30 +1,109 @@
 # import the functions Blueprint() and render_template() from the Flask module
-from flask import Blueprint, render_template, session, redirect
+from flask import Blueprint, render_template, session, redirect, request, abort
+from sqlalchemy.orm import joinedload
 from app.models import Post
-from app.db import get_db
+from app.db import get_db, read_only
+from app.utils.feed import paginate
+from app.utils.post_views import get_post_view
+from app.utils.http_cache import conditional, feed_keys, post_keys
+from app.utils.search import search as search_posts
 
 # Blueprint() lets us consolidate routes onto a single bp object that the parent app can register later. 
 # This corresponds to using the Router middleware of Express.js
 bp = Blueprint('home', __name__, url_prefix='/')
 
+# the homepage can be ordered by age or by "hot" ranking; each ordering is a list of columns to page through with the keyset cursor
+FEED_SORTS = {
+  'new': [Post.created_at, Post.id],
+  'hot': [Post.hot_score, Post.id]
+}
+
 # define two new functions: index() and login()
 # In each case, we add a @bp.route() decorator before the function to turn it into a route.
 # Remember, whatever the function returns becomes the response. 
 # And this time, we use the render_template() function to respond with a template instead of a string.
 @bp.route('/')
+@read_only
+@conditional(feed_keys)
 def index():
-  # get all posts
+  # get one page of posts
   # get_db() function returns a session connection that's tied to this route's context. 
-  # We then use the query() method on the connection object to query the Post model for all posts in descending order, and we save the results in the posts variable
+  # We then query the Post model newest-first, one page at a time. The ?after= query parameter is the cursor that the previous page handed out.
+  # joinedload() fetches each post's author in the same SELECT, so the template doesn't trigger a lazy query per post
+  # ?sort=hot switches to the ranked feed, which pages through the stored hot_score instead of created_at
   db = get_db()
-  posts = db.query(Post).order_by(Post.created_at.desc()).all()
+  sort = request.args.get('sort', 'new')
+
+  if sort not in FEED_SORTS:
+    abort(400)
+
+  try:
+    posts, next_cursor = paginate(
+      db.query(Post).options(joinedload(Post.user)),
+      FEED_SORTS[sort],
+      after=request.args.get('after')
+    )
+  except ValueError:
+    abort(400)
 
   return render_template(
     'homepage.html',
     posts=posts,
+    sort=sort,
+    next_cursor=next_cursor,
     loggedIn=session.get('loggedIn')
   ) 
 
+# every post linking to one site, newest first. The domain is stored and indexed with each post, so this is the same short range scan as the homepage
+@bp.route('/from/<domain>')
+@read_only
+@conditional(feed_keys)
+def from_domain(domain):
+  db = get_db()
+  domain = domain.lower()
+
+  try:
+    posts, next_cursor = paginate(
+      db.query(Post).options(joinedload(Post.user)).filter(Post.domain == domain),
+      FEED_SORTS['new'],
+      after=request.args.get('after')
+    )
+  except ValueError:
+    abort(400)
+
+  return render_template(
+    'homepage.html',
+    posts=posts,
+    domain=domain,
+    next_cursor=next_cursor,
+    loggedIn=session.get('loggedIn')
+  )
+
+# search results, best match first, paged with the same "More posts" link as the feed
+@bp.route('/search')
+@read_only
+@conditional(feed_keys)
+def search():
+  db = get_db()
+  q = request.args.get('q', '').strip()
+
+  try:
+    posts, _, next_cursor = search_posts(
+      db, q,
+      after=request.args.get('after'),
+      options=[joinedload(Post.user)]
+    )
+  except ValueError:
+    abort(400)
+
+  return render_template(
+    'search.html',
+    posts=posts,
+    q=q,
+    next_cursor=next_cursor,
+    loggedIn=session.get('loggedIn')
+  )
+
 # redirect users away from /login if they're already logged in
 @bp.route('/login')
 def login():
@@ -39,10 +118,17 @@ def login():
 # Note the <id> route parameter in the decorator function that becomes a function parameter in the single() function. 
 # We can use that parameter to query the database for a specific post.
 @bp.route('/post/<id>')
+@read_only
+@conditional(post_keys)
 def single(id):
   # get single post by id
   db = get_db()
-  post = db.query(Post).filter(Post.id == id).one()
+  # the post, its author and the first page of comments come from the post view cache, or are loaded in two eager queries on a miss.
+  # ?order=newest and the ?after= cursor (the page's "more comments" link) load just the page of comments asked for
+  try:
+    post = get_post_view(db, id, order=request.args.get('order', 'oldest'), after=request.args.get('after'))
+  except (KeyError, ValueError):
+    abort(400)
 
   # render single post template
   return render_template(
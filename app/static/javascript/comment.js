@@ -2,8 +2,8 @@ async function commentFormHandler(event) {
   event.preventDefault();
 
   const comment_text = document.querySelector('textarea[name="comment-body"]').value.trim();
-  const post_id = window.location.toString().split('/')[
-    window.location.toString().split('/').length - 1
+  const post_id = window.location.pathname.split('/')[
+    window.location.pathname.split('/').length - 1
   ];
 
   if (comment_text) {
@@ -0,0 +1,87 @@
+// Keeps the page current without reloading: listens to /api/events and patches vote counts, comment counts and new comments in place.
+// Only the posts on the page are followed: the one post on a post page, or every post shown on a feed.
+// The first page of the newest-first homepage (marked data-new-posts) also hears about new posts, and offers to show them.
+const ids = Array.from(document.querySelectorAll('article.post[data-post-id]')).map(post => post.dataset.postId);
+const postList = document.querySelector('.post-list[data-new-posts]');
+let newPosts = 0;
+
+function formatPlural(amount, word) {
+  return amount !== 1 ? word + 's' : word;
+}
+
+function updateCounts(event) {
+  const post = JSON.parse(event.data);
+
+  document.querySelectorAll(`article.post[data-post-id="${post.id}"]`).forEach(article => {
+    article.querySelector('.vote-count').textContent = `${post.vote_count} ${formatPlural(post.vote_count, 'point')}`;
+    article.querySelector('.comment-count').textContent = post.comment_count;
+  });
+}
+
+// new comments only show up on the post's own page, and only when they're being shown oldest first (they belong at the end)
+function appendComment(event) {
+  const comment = JSON.parse(event.data);
+  const comments = document.querySelector('.comments');
+  const newestFirst = new URLSearchParams(window.location.search).get('order') === 'newest';
+
+  if (!comments || newestFirst || document.querySelector('.load-comments-link')) {
+    return;
+  }
+
+  const section = document.createElement('section');
+  section.className = 'comment';
+
+  const meta = document.createElement('div');
+  meta.className = 'meta';
+  const date = new Date(comment.created_at);
+  meta.textContent = `${comment.username} on ${[date.getMonth() + 1, date.getDate(), date.getFullYear() % 100]
+    .map(part => String(part).padStart(2, '0')).join('/')}`;
+
+  const text = document.createElement('div');
+  text.className = 'text';
+  text.textContent = comment.comment_text;
+
+  section.append(meta, text);
+  comments.append(section);
+}
+
+function removePost(event) {
+  const post = JSON.parse(event.data);
+
+  document.querySelectorAll(`article.post[data-post-id="${post.id}"]`).forEach(article => {
+    (article.closest('li') || article).remove();
+  });
+}
+
+// new posts aren't rendered here (they'd need the post-info markup); a link above the list counts them and reloads
+function announcePost() {
+  let link = document.querySelector('.new-posts-link');
+
+  if (!link) {
+    link = document.createElement('a');
+    link.className = 'new-posts-link';
+    link.href = '/?sort=new';
+    postList.before(link);
+  }
+
+  newPosts += 1;
+  link.textContent = `${newPosts} new ${formatPlural(newPosts, 'post')}, show`;
+}
+
+if ((ids.length || postList) && window.EventSource) {
+  const params = new URLSearchParams();
+  if (ids.length) {
+    params.set('posts', ids.join(','));
+  }
+  if (postList) {
+    params.set('created', '1');
+  }
+  const source = new EventSource(`/api/events?${params}`);
+
+  source.addEventListener('post', updateCounts);
+  source.addEventListener('created', announcePost);
+  source.addEventListener('comment', appendComment);
+  source.addEventListener('deleted', removePost);
+  // we fell too far behind to catch up with deltas, so start over from a fresh page
+  source.addEventListener('reset', () => document.location.reload());
+}
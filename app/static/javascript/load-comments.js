@@ -0,0 +1,57 @@
+// the same mm/dd/yy format as the format_date template filter
+function formatDate(isoDate) {
+  const date = new Date(isoDate);
+
+  return [date.getMonth() + 1, date.getDate(), date.getFullYear() % 100]
+    .map(part => String(part).padStart(2, '0'))
+    .join('/');
+}
+
+function renderComment(comment) {
+  const section = document.createElement('section');
+  section.className = 'comment';
+
+  const meta = document.createElement('div');
+  meta.className = 'meta';
+  meta.textContent = `${comment.username} on ${formatDate(comment.created_at)}`;
+
+  const text = document.createElement('div');
+  text.className = 'text';
+  text.textContent = comment.comment_text;
+
+  section.append(meta, text);
+  return section;
+}
+
+// fetches the next page of comments from the API and appends it, instead of reloading the whole page
+async function loadCommentsHandler(event) {
+  event.preventDefault();
+
+  const link = event.target;
+  const params = new URLSearchParams({
+    order: link.dataset.order,
+    after: link.dataset.after,
+    fields: 'comment_text,username,created_at'
+  });
+
+  const response = await fetch(`/api/posts/${link.dataset.postId}/comments?${params}`);
+
+  if (!response.ok) {
+    alert(response.statusText);
+    return;
+  }
+
+  const page = await response.json();
+  const comments = document.querySelector('.comments');
+
+  page.comments.forEach(comment => comments.append(renderComment(comment)));
+
+  if (page.next_cursor) {
+    link.dataset.after = page.next_cursor;
+    link.href = `?order=${link.dataset.order}&after=${page.next_cursor}`;
+  } else {
+    link.remove();
+  }
+}
+
+document.querySelector('.load-comments-link').addEventListener('click', loadCommentsHandler);
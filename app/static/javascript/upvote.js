@@ -1,8 +1,8 @@
 async function upvoteClickHandler(event) {
   event.preventDefault();
 
-  const id = window.location.toString().split('/')[
-    window.location.toString().split('/').length - 1
+  const id = window.location.pathname.split('/')[
+    window.location.pathname.split('/').length - 1
   ];
   const response = await fetch('/api/posts/upvote', {
     method: 'PUT',
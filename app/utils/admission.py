@@ -0,0 +1,177 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.pool import QueuePool
+from flask import g, request, session, current_app, jsonify
+from app.db import engine
+from app.utils.metrics import registry
+
+# Admission control: every request that touches the database belongs to a route class, and each class may only run
+# so many requests at once (ADMISSION_LIMITS). Together the limits match the connection pool (they're scaled to the engine's
+# pool size at startup), so a surge of one kind of request queues up in its own class instead of starving everything else of connections.
+# A request that finds its class full waits in a short queue; if the queue is full too, or the wait runs past
+# ADMISSION_QUEUE_TIMEOUT, it is turned away at once with 503 and Retry-After, long before the pool would have timed out.
+#
+# On top of that, the api write routes have a per-user token bucket (WRITE_RATE tokens a second, up to WRITE_BURST saved up),
+# answered with 429 when it runs dry. Both only see the requests of this process.
+
+ROUTE_CLASSES = {
+  'feed': ['home.index', 'home.from_domain', 'home.search', 'dashboard.dash', 'api.posts', 'api.search_posts'],
+  'post': ['home.single', 'dashboard.edit', 'api.post_comments'],
+  'write': [
+    'api.comment', 'api.upvote', 'api.create', 'api.update', 'api.delete',
+    'api.create_batch', 'api.comment_batch', 'api.upvote_batch'
+  ],
+  'auth': ['api.signup', 'api.login']
+}
+ENDPOINT_CLASSES = { endpoint: name for name, endpoints in ROUTE_CLASSES.items() for endpoint in endpoints }
+
+registry.describe('admission_requests_total', 'Requests by route class and outcome: admitted straight away, admitted after queueing, or shed.')
+registry.describe('rate_limited_requests_total', 'Write requests refused by the per-user token bucket.')
+
+class Gate:
+  def __init__(self, limit, queue_size):
+    self.limit = limit
+    self.queue_size = queue_size
+    self.active = 0
+    self.waiting = 0
+    self._cond = threading.Condition()
+
+  # returns 'admitted', 'queued' (admitted after waiting) or None when the request should be shed
+  def enter(self, timeout):
+    with self._cond:
+      if self.active < self.limit:
+        self.active += 1
+        return 'admitted'
+
+      if self.waiting >= self.queue_size:
+        return None
+
+      self.waiting += 1
+      deadline = time.monotonic() + timeout
+
+      try:
+        while self.active >= self.limit:
+          remaining = deadline - time.monotonic()
+
+          if remaining <= 0:
+            return None
+
+          self._cond.wait(remaining)
+
+        self.active += 1
+        return 'queued'
+      finally:
+        self.waiting -= 1
+
+  def leave(self):
+    with self._cond:
+      self.active -= 1
+      self._cond.notify()
+
+class TokenBuckets:
+  def __init__(self, rate, burst, max_keys=100000):
+    self.rate = rate
+    self.burst = burst
+    self.max_keys = max_keys
+    # key -> (tokens, time of the last refill); least recently seen keys are forgotten first
+    self._buckets = OrderedDict()
+    self._lock = threading.Lock()
+
+  # takes a token for `key`, returning 0 when there was one, or else how many seconds until there will be
+  def take(self, key):
+    now = time.monotonic()
+
+    with self._lock:
+      tokens, last = self._buckets.pop(key, (self.burst, now))
+      tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+      if tokens >= 1:
+        tokens -= 1
+        wait = 0
+      else:
+        wait = (1 - tokens) / self.rate
+
+      self._buckets[key] = (tokens, now)
+      if len(self._buckets) > self.max_keys:
+        self._buckets.popitem(last=False)
+
+    return wait
+
+def _refuse(message, status, retry_after):
+  response = jsonify(message = message)
+  response.status_code = status
+  response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+
+  return response
+
+def _admit():
+  route_class = ENDPOINT_CLASSES.get(request.endpoint)
+
+  if route_class is None:
+    return None
+
+  state = current_app.extensions['admission']
+
+  if route_class == 'write' and state['buckets'] is not None:
+    wait = state['buckets'].take(session.get('user_id') or request.remote_addr)
+
+    if wait:
+      registry.inc('rate_limited_requests_total', (('route', request.endpoint),))
+      return _refuse('Too many writes, slow down', 429, wait)
+
+  gate = state['gates'].get(route_class)
+
+  if gate is None:
+    return None
+
+  outcome = gate.enter(current_app.config['ADMISSION_QUEUE_TIMEOUT'])
+  registry.inc('admission_requests_total', (('class', route_class), ('outcome', outcome or 'shed')))
+
+  if outcome is None:
+    return _refuse('Server busy, try again shortly', 503, 1)
+
+  g.admission_gate = gate
+
+# runs when the request is completely done, including streaming its body, so the slot is held for as long as the database may be used
+def _release(e=None):
+  gate = g.pop('admission_gate', None)
+
+  if gate is not None:
+    gate.leave()
+
+# the configured limits are shares of the pool: scaled so they add up to `pool_size`, keeping at least one slot per class.
+# Rounding down can leave a few connections over, which go to the classes that lost the largest fractions
+def scale_limits(limits, pool_size):
+  total = sum(limit for limit, _ in limits.values())
+
+  if not total or total == pool_size:
+    return dict(limits)
+
+  shares = { name: limit * pool_size / total for name, (limit, _) in limits.items() }
+  scaled = { name: max(1, int(share)) for name, share in shares.items() }
+  left = max(0, pool_size - sum(scaled.values()))
+
+  for name in sorted(shares, key=lambda name: shares[name] - int(shares[name]), reverse=True)[:left]:
+    scaled[name] += 1
+
+  return { name: (scaled[name], queue_size) for name, (_, queue_size) in limits.items() }
+
+# create_app() calls init_admission() after init_metrics(), so queueing time still counts toward a request's measured duration.
+# ADMISSION_LIMITS maps a route class to (concurrent requests, queue length); None turns admission control off, and WRITE_RATE=None turns off rate limiting
+def init_admission(app):
+  limits = app.config['ADMISSION_LIMITS'] or {}
+  rate = app.config['WRITE_RATE']
+
+  # SQLite doesn't queue for connections, so only a real pool (sized by DB_POOL_SIZE) has a size to match
+  if isinstance(engine.pool, QueuePool):
+    limits = scale_limits(limits, engine.pool.size())
+
+  app.extensions['admission'] = {
+    'gates': { name: Gate(limit, queue_size) for name, (limit, queue_size) in limits.items() },
+    'buckets': TokenBuckets(rate, app.config['WRITE_BURST']) if rate else None
+  }
+
+  app.before_request(_admit)
+  app.teardown_request(_release)
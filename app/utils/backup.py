@@ -0,0 +1,170 @@
+import gzip
+import json
+import os
+import sys
+from datetime import datetime
+from sqlalchemy import DateTime, select, text
+from app.db import engine, Session, insert_ignore
+from app.models import User, Post, Comment, Vote
+from app.utils import versions
+from app.utils.filters import url_domain
+
+# Backups as NDJSON: one JSON object per line, { "table": "posts", "row": { ...every column... } }.
+# The tables are written parents first (users, posts, comments, votes), so an import never inserts a row before the row it points to.
+#
+# Export reads each table through SQLAlchemy Core with a server-side cursor, one --chunk-size batch at a time,
+# so memory stays flat however many rows there are: no ORM objects, no identity map, no list of everything.
+# All four tables are read inside one transaction, so the file is a consistent snapshot on databases with repeatable reads.
+#
+# Import inserts each table's rows in chunked multi-row INSERTs, committing after every chunk and writing a checkpoint
+# (the number of lines done) next to the file. If it stops halfway, running it again resumes from the checkpoint.
+# The INSERTs skip rows whose primary key already exists, so replaying the last chunk after a crash is harmless.
+MODELS = [User, Post, Comment, Vote]
+TABLES = { model.__tablename__: model.__table__ for model in MODELS }
+
+def open_backup(path, mode, compress=None):
+  if compress is None:
+    compress = path.endswith('.gz')
+
+  if path == '-':
+    stream = sys.stdout.buffer if 'w' in mode else sys.stdin.buffer
+    return gzip.open(stream, mode + 't', encoding='utf-8') if compress else open(stream.fileno(), mode, encoding='utf-8', closefd=False)
+
+  if compress:
+    return gzip.open(path, mode + 't', encoding='utf-8')
+
+  return open(path, mode, encoding='utf-8')
+
+def _json_value(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+
+  return value
+
+# writes every table to `out` and returns { table name: rows written }
+def export_tables(out, chunk_size=10000):
+  written = {}
+
+  with engine.connect() as conn:
+    with conn.begin():
+      streaming = conn.execution_options(stream_results=True)
+
+      for name, table in TABLES.items():
+        written[name] = 0
+        result = streaming.execute(select([table]).order_by(*table.primary_key.columns))
+
+        for rows in result.partitions(chunk_size):
+          out.write(''.join(
+            json.dumps({ 'table': name, 'row': { key: _json_value(value) for key, value in row._mapping.items() } }) + '\n'
+            for row in rows
+          ))
+          written[name] += len(rows)
+
+  return written
+
+def checkpoint_path(path):
+  return path + '.checkpoint'
+
+def read_checkpoint(path):
+  try:
+    with open(checkpoint_path(path)) as f:
+      return json.load(f)['line']
+  except (OSError, ValueError, KeyError):
+    return 0
+
+def write_checkpoint(path, line):
+  # write then rename, so a crash mid-write never leaves a half-written checkpoint behind
+  temp = checkpoint_path(path) + '.tmp'
+
+  with open(temp, 'w') as f:
+    json.dump({ 'line': line }, f)
+
+  os.replace(temp, checkpoint_path(path))
+
+# turns a row from the file back into column values: ISO strings into datetimes, and columns this schema doesn't have are dropped
+def _parse_row(table, row):
+  values = {}
+
+  for key, value in row.items():
+    if key not in table.c:
+      continue
+
+    if value is not None and isinstance(table.c[key].type, DateTime):
+      value = datetime.fromisoformat(value)
+
+    values[key] = value
+
+  # files exported before posts stored their domain
+  if table.name == 'posts' and 'domain' not in values and 'post_url' in values:
+    values['domain'] = url_domain(values['post_url'])
+
+  return values
+
+# after inserting explicit ids, PostgreSQL's sequences still start at 1, so move them past the imported rows
+def _reset_sequences(db):
+  if db.get_bind().dialect.name != 'postgresql':
+    return
+
+  for name in TABLES:
+    db.execute(text(
+      "SELECT setval(pg_get_serial_sequence('{0}', 'id'), COALESCE((SELECT MAX(id) FROM {0}), 0) + 1, false)".format(name)
+    ))
+
+# reads the file at `path` and returns { table name: rows inserted }.
+# resume=False ignores any checkpoint and starts from the first line
+def import_tables(path, chunk_size=10000, compress=None, resume=True):
+  start = read_checkpoint(path) if resume else 0
+  inserted = { name: 0 for name in TABLES }
+  db = Session()
+
+  chunk = []
+  chunk_table = None
+
+  # inserts the pending chunk, commits, and records that the first `done` lines are in
+  def flush(done):
+    if chunk:
+      result = db.execute(insert_ignore(db, TABLES[chunk_table]), chunk)
+      inserted[chunk_table] += max(result.rowcount, 0)
+    db.commit()
+    write_checkpoint(path, done)
+    chunk.clear()
+
+  try:
+    with open_backup(path, 'r', compress) as lines:
+      line_number = start
+
+      for line_number, line in enumerate(lines, 1):
+        if line_number <= start or not line.strip():
+          continue
+
+        record = json.loads(line)
+        name = record['table']
+
+        if name not in TABLES:
+          raise ValueError('Line {}: unknown table {}'.format(line_number, name))
+
+        # a chunk only ever holds one table's rows, so it can go in as one INSERT
+        if chunk and name != chunk_table:
+          flush(line_number - 1)
+
+        chunk_table = name
+        chunk.append(_parse_row(TABLES[name], record['row']))
+
+        if len(chunk) >= chunk_size:
+          flush(line_number)
+
+      flush(line_number)
+
+    _reset_sequences(db)
+    # everything on the site may have changed, so every cached page is stale
+    versions.bump(db)
+    db.commit()
+  except Exception:
+    db.rollback()
+    raise
+  finally:
+    db.close()
+
+  os.remove(checkpoint_path(path))
+
+  return inserted
@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, render_template, has_app_context
+from markupsafe import Markup
+
+# Cache backends all speak the same tiny get()/set()/delete() interface with string keys (the fragment cache stores strings in them),
+# so the fragment cache below doesn't care where the HTML actually lives.
+
+# in-process backend: a dictionary that forgets the least recently used entry once it holds max_size of them.
+# With a ttl (in seconds) entries also expire, which bounds how stale an entry can get when another process made the change
+class LRUCache:
+  def __init__(self, max_size=10000, ttl=None):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      if key not in self._data:
+        return None
+
+      expires, value = self._data[key]
+      if expires is not None and expires < time.monotonic():
+        del self._data[key]
+        return None
+
+      self._data.move_to_end(key)
+      return value
+
+  def set(self, key, value):
+    expires = time.monotonic() + self.ttl if self.ttl else None
+
+    with self._lock:
+      self._data[key] = (expires, value)
+      self._data.move_to_end(key)
+
+      while len(self._data) > self.max_size:
+        self._data.popitem(last=False)
+
+  def delete(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def __len__(self):
+    return len(self._data)
+
+# shared backend: wraps a Redis-style client (get/set with ex=/delete, bytes values), so every worker process sees the same entries
+class SharedCache:
+  def __init__(self, client, prefix='newsfeed:', ttl=3600):
+    self.client = client
+    self.prefix = prefix
+    self.ttl = ttl
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+
+    return value.decode('utf-8') if value is not None else None
+
+  def set(self, key, value):
+    self.client.set(self.prefix + key, value.encode('utf-8'), ex=self.ttl)
+
+  def delete(self, key):
+    self.client.delete(self.prefix + key)
+
+# local stand-in for a Redis client, used when no FRAGMENT_CACHE_URL is configured (and handy for trying the shared backend on a laptop).
+# It ignores the expiry, since nothing outlives the process anyway
+class LocalClient:
+  def __init__(self):
+    self._data = {}
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      return self._data.get(key)
+
+  def set(self, key, value, ex=None):
+    with self._lock:
+      self._data[key] = value
+
+  def delete(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+# FragmentCache stores the rendered HTML of partials/post-info.html for each post.
+# Entries are keyed by post id and tagged with a version built from everything the partial displays that can change,
+# so a stale entry is never served even if an invalidation is missed; invalidate() just frees the entry early.
+class FragmentCache:
+  def __init__(self, backend):
+    self.backend = backend
+    self.hits = 0
+    self.misses = 0
+
+  def render(self, post, render):
+    key = 'post-info:{}'.format(post.id)
+    version = post_version(post)
+
+    cached = self.backend.get(key)
+    if cached is not None:
+      cached_version, _, html = cached.partition('|')
+
+      if cached_version == version:
+        self.hits += 1
+        return html
+
+    self.misses += 1
+    html = render(post)
+    self.backend.set(key, '{}|{}'.format(version, html))
+
+    return html
+
+  def invalidate(self, post_id):
+    self.backend.delete('post-info:{}'.format(post_id))
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'size': len(self.backend) if hasattr(self.backend, '__len__') else None
+    }
+
+def post_version(post):
+  updated_at = post.updated_at.timestamp() if post.updated_at else 0
+
+  return '{}.{}.{}'.format(post.vote_count, post.comment_count, updated_at)
+
+def _make_backend(app):
+  backend = app.config['FRAGMENT_CACHE_BACKEND']
+
+  if backend == 'lru':
+    return LRUCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+  if backend == 'shared':
+    url = app.config['FRAGMENT_CACHE_URL']
+
+    if url:
+      # redis is only needed when a shared cache server is actually configured
+      import redis
+      client = redis.Redis.from_url(url)
+    else:
+      client = LocalClient()
+
+    return SharedCache(client, ttl=app.config['FRAGMENT_CACHE_TTL'])
+
+  raise ValueError('Unknown FRAGMENT_CACHE_BACKEND: {}'.format(backend))
+
+# init_cache() follows the same pattern as init_db(): create_app() calls it once the config is loaded.
+# Templates render a post with {{ render_post_info(post) }} instead of including the partial directly
+def init_cache(app):
+  if app.config['FRAGMENT_CACHE_BACKEND']:
+    app.extensions['fragment_cache'] = FragmentCache(_make_backend(app))
+
+  # assembled single-post views (see app/utils/post_views.py) live in a small in-process LRU with a TTL
+  if app.config['POST_VIEW_CACHE_SIZE']:
+    app.extensions['post_view_cache'] = LRUCache(
+      app.config['POST_VIEW_CACHE_SIZE'],
+      ttl=app.config['POST_VIEW_CACHE_TTL']
+    )
+
+  app.jinja_env.globals['render_post_info'] = render_post_info
+
+def render_post_info(post):
+  cache = current_app.extensions.get('fragment_cache')
+
+  if cache is None:
+    html = _render_post_info(post)
+  else:
+    html = cache.render(post, _render_post_info)
+
+  return Markup(html)
+
+def _render_post_info(post):
+  return render_template('partials/post-info.html', post=post)
+
+# the write routes call invalidate_post() after committing a change to a post, its votes or its comments
+def invalidate_post(post_id):
+  if not has_app_context():
+    return
+
+  cache = current_app.extensions.get('fragment_cache')
+  if cache is not None:
+    cache.invalidate(post_id)
+
+  views = current_app.extensions.get('post_view_cache')
+  if views is not None:
+    views.delete(str(post_id))
@@ -0,0 +1,154 @@
+from datetime import datetime
+from sqlalchemy import select, func, bindparam
+from app.models import User, Post, Comment, Vote
+from app.utils import versions
+
+# Post.vote_count and Post.comment_count are denormalized counters.
+# Every write that adds a vote or a comment calls one of these helpers on the same session, before db.commit(),
+# so the counter and the row it counts are saved (or rolled back) together.
+# The UPDATE does the arithmetic in SQL (vote_count = vote_count + 1), so concurrent requests can't overwrite each other's increments.
+# A counter changing isn't an edit of the post, so each UPDATE also sets updated_at to itself, which keeps the column's onupdate from firing
+def add_vote(db, post_id):
+  db.query(Post).filter(Post.id == post_id).update(
+    {Post.vote_count: Post.vote_count + 1, Post.updated_at: Post.updated_at},
+    synchronize_session=False
+  )
+
+def add_comment(db, post_id):
+  db.query(Post).filter(Post.id == post_id).update(
+    {Post.comment_count: Post.comment_count + 1, Post.updated_at: Post.updated_at},
+    synchronize_session=False
+  )
+
+# add_comments() is the bulk version of add_comment(): one executemany UPDATE that adds n to each post's comment count
+def add_comments(db, counts):
+  if not counts:
+    return
+
+  posts = Post.__table__
+  db.execute(
+    posts.update()
+    .where(posts.c.id == bindparam('post_id'))
+    .values(comment_count=posts.c.comment_count + bindparam('n'), updated_at=posts.c.updated_at),
+    [{ 'post_id': post_id, 'n': n } for post_id, n in counts.items()]
+  )
+
+# _recount() points both counters at a COUNT over the votes and comments tables for every post that the query matches, in one set-based UPDATE
+def _recount(query):
+  votes = select([func.count(Vote.id)]).where(Vote.post_id == Post.id).scalar_subquery()
+  comments = select([func.count(Comment.id)]).where(Comment.post_id == Post.id).scalar_subquery()
+
+  return query.update(
+    {Post.vote_count: votes, Post.comment_count: comments, Post.updated_at: Post.updated_at},
+    synchronize_session=False
+  )
+
+# recount_votes() only touches vote_count, for the vote pipeline that inserts votes in bulk and can't know which ones were duplicates
+def recount_votes(db, post_ids):
+  votes = select([func.count(Vote.id)]).where(Vote.post_id == Post.id).scalar_subquery()
+
+  return db.query(Post).filter(Post.id.in_(post_ids)).update(
+    {Post.vote_count: votes, Post.updated_at: Post.updated_at},
+    synchronize_session=False
+  )
+
+# recount_posts() is the slow-but-exact path for a handful of posts, for writes where recounting is simpler than tracking increments
+def recount_posts(db, post_ids):
+  return _recount(db.query(Post).filter(Post.id.in_(post_ids)))
+
+# Per-user totals for the dashboard (User.post_count, votes_received, comments_received, last_active_at) work the same way:
+# the write routes adjust them with arithmetic UPDATEs in their own transaction, and reconcile_counts() recomputes them.
+# Votes and comments are credited to the post's author, found with a subquery so the route doesn't have to load the post first
+
+# a new post (or n of them, for the batch route) by this user
+def add_posts(db, user_id, n=1):
+  db.query(User).filter(User.id == user_id).update(
+    {User.post_count: User.post_count + n, User.last_active_at: datetime.now()},
+    synchronize_session=False
+  )
+
+# marks users as active now, for writes that don't change any of their own totals
+def touch_users(db, user_ids):
+  db.query(User).filter(User.id.in_(user_ids)).update(
+    {User.last_active_at: datetime.now()},
+    synchronize_session=False
+  )
+
+# credits each post's author with n more votes or comments, given { post_id: n }, in one executemany UPDATE
+def _add_received(db, column, counts):
+  if not counts:
+    return
+
+  users = User.__table__
+  author = select([Post.__table__.c.user_id]).where(Post.__table__.c.id == bindparam('post_id')).scalar_subquery()
+
+  db.execute(
+    users.update()
+    .where(users.c.id == author)
+    .values({ column: users.c[column] + bindparam('n') }),
+    [{ 'post_id': post_id, 'n': n } for post_id, n in counts.items()]
+  )
+
+def add_votes_received(db, counts):
+  _add_received(db, 'votes_received', counts)
+
+def add_comments_received(db, counts):
+  _add_received(db, 'comments_received', counts)
+
+# a deleted post takes its votes and comments with it, so its author gives back what the post had received
+def remove_post(db, post):
+  db.query(User).filter(User.id == post.user_id).update(
+    {
+      User.post_count: User.post_count - 1,
+      User.votes_received: User.votes_received - post.vote_count,
+      User.comments_received: User.comments_received - post.comment_count,
+      User.last_active_at: datetime.now()
+    },
+    synchronize_session=False
+  )
+
+# recomputes the received totals from the posts' stored counters, in one set-based UPDATE for every user the query matches.
+# Run it after the post counters themselves are right
+def _recount_users(query):
+  posts = select([func.count(Post.id)]).where(Post.user_id == User.id).scalar_subquery()
+  votes = select([func.coalesce(func.sum(Post.vote_count), 0)]).where(Post.user_id == User.id).scalar_subquery()
+  comments = select([func.coalesce(func.sum(Post.comment_count), 0)]).where(Post.user_id == User.id).scalar_subquery()
+
+  return query.update(
+    {User.post_count: posts, User.votes_received: votes, User.comments_received: comments},
+    synchronize_session=False
+  )
+
+# recount_authors() is for the vote pipeline again: after recount_votes(), bring the totals of those posts' authors back in line
+def recount_authors(db, post_ids):
+  authors = select([Post.user_id]).where(Post.id.in_(post_ids))
+
+  return _recount_users(db.query(User).filter(User.id.in_(authors)))
+
+# reconcile_counts() repairs every post, walking the table in id ranges and committing after each chunk,
+# so a large table never sits inside one long transaction
+def reconcile_counts(db, chunk_size=10000):
+  max_id = db.query(func.max(Post.id)).scalar() or 0
+  updated = 0
+
+  for start in range(0, max_id + 1, chunk_size):
+    updated += _recount(db.query(Post).filter(Post.id >= start, Post.id < start + chunk_size))
+    db.commit()
+
+  reconcile_users(db, chunk_size)
+
+  versions.bump(db)
+  db.commit()
+
+  return updated
+
+# the per-user half of reconcile_counts(), in user id ranges. A user who never got a last_active_at is given the time of their latest post
+def reconcile_users(db, chunk_size=10000):
+  max_id = db.query(func.max(User.id)).scalar() or 0
+  latest_post = select([func.max(Post.created_at)]).where(Post.user_id == User.id).scalar_subquery()
+
+  for start in range(0, max_id + 1, chunk_size):
+    users = db.query(User).filter(User.id >= start, User.id < start + chunk_size)
+    _recount_users(users)
+    users.filter(User.last_active_at == None).update({User.last_active_at: latest_post}, synchronize_session=False)
+    db.commit()
@@ -0,0 +1,32 @@
+from sqlalchemy import bindparam
+from app.models import Post
+from app.utils.filters import url_domain
+
+# fills in Post.domain for posts written before the column existed, in id-ordered chunks with one executemany UPDATE and commit each
+def backfill_domains(db, chunk_size=10000):
+  posts = Post.__table__
+  updated = 0
+  last_id = 0
+
+  while True:
+    rows = (
+      db.query(Post.id, Post.post_url)
+      .filter(Post.domain == None, Post.id > last_id)
+      .order_by(Post.id)
+      .limit(chunk_size)
+      .all()
+    )
+
+    if not rows:
+      break
+
+    db.execute(
+      posts.update().where(posts.c.id == bindparam('post_id')).values(domain=bindparam('new_domain')),
+      [{ 'post_id': row.id, 'new_domain': url_domain(row.post_url) } for row in rows]
+    )
+    db.commit()
+
+    updated += len(rows)
+    last_id = rows[-1].id
+
+  return updated
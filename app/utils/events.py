@@ -0,0 +1,200 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app.models import User, Post, Comment
+
+# Live updates over server-sent events (GET /api/events), so open pages can patch in new vote counts and comments
+# instead of reloading and re-running the whole feed query.
+#
+# The write routes publish small deltas to an in-process hub once their transaction has committed:
+#   post     { id, vote_count, comment_count }   after an upvote or a comment
+#   comment  { id, post_id, comment_text, username, created_at }
+#   created  { id, title, post_url }           only to subscribers that follow new posts (?created=1, the newest-first homepage)
+#   deleted  { id }
+# Every subscriber has its own buffer, keyed by what the event is about, so a burst of votes on one post collapses into one
+# `post` event carrying the latest counts. A subscriber that falls EVENTS_BUFFER_SIZE events behind is sent a single
+# `reset` event instead (reload to catch up), so one slow client can never make the hub hold an unbounded backlog.
+#
+# The hub only sees writes made by this process. Each open stream holds a worker thread (but never a database connection)
+# for as long as the page is open, which is why live updates are opt-in (LIVE_UPDATES) and capped at EVENTS_MAX_SUBSCRIBERS streams.
+
+class Subscriber:
+  def __init__(self, post_ids=None, buffer_size=100, new_posts=False):
+    # None means every post, including new and deleted ones. A page following only its own posts
+    # can still ask for new posts with `new_posts`
+    self.post_ids = post_ids
+    self.new_posts = new_posts
+    self.buffer_size = buffer_size
+    self.pending = OrderedDict()
+    self.overflowed = False
+    self.lock = threading.Lock()
+    self.ready = threading.Event()
+
+  def wants(self, post_id):
+    if post_id is None:
+      return self.post_ids is None or self.new_posts
+
+    return self.post_ids is None or post_id in self.post_ids
+
+  # buffers an event and returns True if that just made the subscriber overflow
+  def put(self, key, kind, data):
+    overflowed = False
+
+    with self.lock:
+      if self.overflowed:
+        return False
+
+      # a newer event about the same thing replaces the older one in place
+      if key not in self.pending and len(self.pending) >= self.buffer_size:
+        self.pending.clear()
+        self.overflowed = overflowed = True
+      else:
+        self.pending[key] = (kind, data)
+
+    self.ready.set()
+    return overflowed
+
+  # everything buffered so far, as a list of (kind, data)
+  def drain(self):
+    with self.lock:
+      if self.overflowed:
+        self.overflowed = False
+        events = [('reset', {})]
+      else:
+        events = list(self.pending.values())
+
+      self.pending.clear()
+      self.ready.clear()
+
+    return events
+
+class EventHub:
+  def __init__(self, buffer_size=100, max_subscribers=1000):
+    self.buffer_size = buffer_size
+    self.max_subscribers = max_subscribers
+    self._subscribers = set()
+    self._lock = threading.Lock()
+    self.published = 0
+    self.overflows = 0
+
+  def subscribe(self, post_ids=None, new_posts=False):
+    subscriber = Subscriber(post_ids, self.buffer_size, new_posts)
+
+    with self._lock:
+      if len(self._subscribers) >= self.max_subscribers:
+        return None
+      self._subscribers.add(subscriber)
+
+    return subscriber
+
+  def unsubscribe(self, subscriber):
+    with self._lock:
+      self._subscribers.discard(subscriber)
+
+  def has_subscribers(self):
+    return bool(self._subscribers)
+
+  # events without a post_id (new posts) only go to subscribers following the whole feed or asking for new posts
+  def publish(self, key, kind, data, post_id=None):
+    with self._lock:
+      subscribers = list(self._subscribers)
+      self.published += 1
+
+    for subscriber in subscribers:
+      if subscriber.wants(post_id) and subscriber.put(key, kind, data):
+        with self._lock:
+          self.overflows += 1
+
+  def stats(self):
+    return {
+      'subscribers': len(self._subscribers),
+      'published': self.published,
+      'overflows': self.overflows
+    }
+
+def get_hub():
+  return current_app.extensions.get('event_hub')
+
+# --- publishing helpers for the write routes; each is a no-op unless someone is listening ---
+
+# reads the current counters of the given posts in one query and publishes a `post` event for each
+def publish_counts(db, post_ids):
+  hub = get_hub()
+
+  if hub is None or not hub.has_subscribers() or not post_ids:
+    return
+
+  for row in db.query(Post.id, Post.vote_count, Post.comment_count).filter(Post.id.in_(post_ids)):
+    hub.publish(
+      'post:{}'.format(row.id), 'post',
+      { 'id': row.id, 'vote_count': row.vote_count, 'comment_count': row.comment_count },
+      post_id=row.id
+    )
+
+# reads new comments with their authors' names in one query and publishes a `comment` event for each
+def publish_comments(db, comment_ids):
+  hub = get_hub()
+
+  if hub is None or not hub.has_subscribers() or not comment_ids:
+    return
+
+  rows = (
+    db.query(Comment.id, Comment.post_id, Comment.comment_text, Comment.created_at, User.username)
+    .join(User, Comment.user_id == User.id)
+    .filter(Comment.id.in_(comment_ids))
+  )
+
+  for row in rows:
+    hub.publish(
+      'comment:{}'.format(row.id), 'comment',
+      { 'id': row.id, 'post_id': row.post_id, 'comment_text': row.comment_text, 'username': row.username, 'created_at': row.created_at.isoformat() },
+      post_id=row.post_id
+    )
+
+def publish_created(post_id, title, post_url):
+  hub = get_hub()
+
+  if hub is not None and hub.has_subscribers():
+    hub.publish('created:{}'.format(post_id), 'created', { 'id': post_id, 'title': title, 'post_url': post_url })
+
+def publish_deleted(post_id):
+  hub = get_hub()
+
+  if hub is not None and hub.has_subscribers():
+    hub.publish('deleted:{}'.format(post_id), 'deleted', { 'id': post_id }, post_id=post_id)
+
+# --- the stream ---
+
+def format_event(kind, data):
+  return 'event: {}\ndata: {}\n\n'.format(kind, json.dumps(data))
+
+# Yields SSE text for one subscriber until the client goes away. After waking up it waits EVENTS_COALESCE_SECONDS
+# so a burst of writes goes out as one batch, and it sends a comment line every EVENTS_KEEPALIVE seconds so proxies keep the connection open
+def stream(hub, subscriber, coalesce_seconds, keepalive_seconds):
+  try:
+    yield 'retry: 5000\n\n'
+
+    while True:
+      if not subscriber.ready.wait(keepalive_seconds):
+        yield ': keepalive\n\n'
+        continue
+
+      if coalesce_seconds:
+        time.sleep(coalesce_seconds)
+
+      yield ''.join(format_event(kind, data) for kind, data in subscriber.drain())
+  finally:
+    hub.unsubscribe(subscriber)
+
+# create_app() calls init_events() to set up the hub when LIVE_UPDATES is on. Without a hub, publishing does nothing
+# and /api/events answers 404, so the pages don't open a stream
+def init_events(app):
+  if not app.config['LIVE_UPDATES']:
+    return
+
+  app.extensions['event_hub'] = EventHub(
+    buffer_size=app.config['EVENTS_BUFFER_SIZE'],
+    max_subscribers=app.config['EVENTS_MAX_SUBSCRIBERS']
+  )
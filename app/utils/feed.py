@@ -0,0 +1,70 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+# Feeds are paginated with a keyset (a.k.a. cursor) instead of OFFSET.
+# Each page remembers the sort values of its last row, and the next page asks for rows that sort strictly after them.
+# With an index on the sort columns, every page is a bounded range scan no matter how many posts the table holds.
+FEED_PAGE_SIZE = 20
+
+# A cursor is just the last row's sort values, serialized to JSON and base64-encoded so that it's safe to put in a URL
+def encode_cursor(values):
+  values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+
+  return urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+# decode_cursor() needs the sort columns so that it can turn each value back into the type that the column expects.
+# A tampered or malformed cursor raises a ValueError, which the routes turn into a 400
+def decode_cursor(cursor, columns):
+  try:
+    values = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+  except Exception:
+    raise ValueError('Invalid cursor')
+
+  if not isinstance(values, list) or len(values) != len(columns):
+    raise ValueError('Invalid cursor')
+
+  decoded = []
+  for column, value in zip(columns, values):
+    try:
+      if column.type.python_type is datetime:
+        value = datetime.fromisoformat(value)
+      elif column.type.python_type in (int, float) and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise ValueError('Invalid cursor')
+    except (TypeError, ValueError):
+      raise ValueError('Invalid cursor')
+    decoded.append(value)
+
+  return decoded
+
+# builds the WHERE clause for "sorts after this row" when every column is sorted in descending order:
+# (a < A) OR (a = A AND b < B) OR ...
+# With descending=False (every column ascending) the comparisons flip to >
+def keyset_filter(columns, values, descending=True):
+  clauses = []
+  for i, column in enumerate(columns):
+    equal = [columns[j] == values[j] for j in range(i)]
+    clauses.append(and_(*equal, column < values[i] if descending else column > values[i]))
+
+  return or_(*clauses)
+
+# page_query() sorts and limits a query to the page that starts after the cursor.
+# It asks for one extra row, so the caller can find out whether another page exists without running a separate COUNT query
+def page_query(query, columns, after=None, limit=FEED_PAGE_SIZE, descending=True):
+  if after:
+    query = query.filter(keyset_filter(columns, decode_cursor(after, columns), descending))
+
+  return query.order_by(*[column.desc() if descending else column.asc() for column in columns]).limit(limit + 1)
+
+# paginate() takes an unsorted query plus its sort columns and returns one page of results and the cursor for the next page (or None on the last page)
+def paginate(query, columns, after=None, limit=FEED_PAGE_SIZE, descending=True):
+  rows = page_query(query, columns, after, limit, descending).all()
+
+  next_cursor = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    last = rows[-1]
+    next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+
+  return rows, next_cursor
@@ -1,26 +1,39 @@
+import re
+from urllib.parse import urlsplit
+
 # format_date() function expects to receive a datetime object and then use the strftime() method to convert it to a string. 
 # The %m/%d/%y format code will result in something like "01/01/20"
 def format_date(date):
   return date.strftime('%m/%d/%y')
 
-
-from datetime import datetime
-print(format_date(datetime.now()))
-
 # This code removes all extraneous information from a URL string, leaving only the domain name. 
 # Note that the methods we use, like replace() and split(), behave exactly the same as they do in JavaScript
 def format_url(url):
   return url.replace('http://', '').replace('https://', '').replace('www.', '').split('/')[0].split('?')[0]
 
-print(format_url('http://google.com/test/')) # test previous code
-print(format_url('https://www.google.com?q=test'))
+# The site a post links to, worked out once when the post is written and stored in Post.domain,
+# instead of being re-parsed by format_url() every time the post is rendered.
+# It's the lowercased host name without "www.", a port or a login, so every link to one site lands on the same /from/<domain> feed
+def url_domain(url):
+  url = (url or '').strip()
+
+  try:
+    host = urlsplit(url if '//' in url else '//' + url).hostname or ''
+  except ValueError:
+    host = ''
+
+  if host.startswith('www.'):
+    host = host[4:]
+
+  # whatever is left has to look like a host name, or the post simply has no domain
+  if not re.fullmatch(r'[\w.-]+', host):
+    return None
+
+  return host[:255]
 
 # address the issue of correctly pluralizing words
 def format_plural(amount, word):
   if amount != 1:
     return word + 's'
 
-  return word
-
-print(format_plural(2, 'cat')) # test previous code
-print(format_plural(1, 'dog'))
\ No newline at end of file
+  return word
\ No newline at end of file
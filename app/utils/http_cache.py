@@ -0,0 +1,62 @@
+import hashlib
+from functools import wraps
+from flask import g, request, session, current_app, make_response
+from app.db import get_db
+from app.utils import versions
+
+# conditional() makes a page answer conditional GETs from the version stamps in app/utils/versions.py.
+# `keys` receives the route's arguments and returns the version keys the page depends on.
+# The ETag hashes those versions together with everything else that changes the HTML: the full URL (cursor, sort...)
+# and who is looking. When the client's If-None-Match (or If-Modified-Since) still matches, we answer 304 straight away,
+# after a single primary-key lookup and without querying posts or rendering anything.
+#
+# Cache-Control: anonymous visitors all see the same page, so shared caches may keep it for ANONYMOUS_MAX_AGE seconds.
+# Logged-in pages are private and always revalidated, which is cheap thanks to the ETag
+def conditional(keys):
+  def decorator(func):
+    @wraps(func)
+    def wrapped_function(*args, **kwargs):
+      version_keys = keys(**kwargs)
+      stamps = versions.read(get_db(), version_keys)
+      # kept for the route, so cached content can be checked against the same stamps the ETag is built from
+      g.version_stamps = { key: stamps.get(key, (0, None)) for key in version_keys }
+      logged_in = session.get('loggedIn') == True
+
+      tag = hashlib.sha1(repr((
+        [(key, stamps.get(key, (0, None))[0]) for key in version_keys],
+        request.full_path,
+        session.get('user_id') if logged_in else None
+      )).encode('utf-8')).hexdigest()
+
+      modified = [updated_at for _, updated_at in stamps.values() if updated_at is not None]
+      last_modified = max(modified).replace(microsecond=0) if modified else None
+
+      not_modified = (
+        request.if_none_match.contains_weak(tag) if request.if_none_match
+        else last_modified is not None and request.if_modified_since is not None
+          and last_modified <= request.if_modified_since.replace(tzinfo=None)
+      )
+
+      response = make_response('', 304) if not_modified else make_response(func(*args, **kwargs))
+
+      response.set_etag(tag)
+      if last_modified is not None:
+        response.last_modified = last_modified
+
+      if logged_in:
+        response.headers['Cache-Control'] = 'private, no-cache'
+      else:
+        response.headers['Cache-Control'] = 'public, max-age={}'.format(current_app.config['ANONYMOUS_MAX_AGE'])
+      response.vary.add('Cookie')
+
+      return response
+
+    return wrapped_function
+
+  return decorator
+
+def feed_keys(**kwargs):
+  return [versions.GLOBAL]
+
+def post_keys(id, **kwargs):
+  return [versions.post_key(id)]
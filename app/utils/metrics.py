@@ -0,0 +1,309 @@
+import threading
+import time
+from flask import g, request, current_app, has_request_context, Response, jsonify
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.db import Session, all_engines
+from app.utils import passwords
+
+# Per-request SQL instrumentation.
+# Engine hooks time every statement, and session hooks time how long we wait for a pooled connection.
+# Both add into g.sql_stats, which the request hooks below start and finish for every request. From there:
+#   - requests that run more statements than QUERY_BUDGET are logged and counted (that's what a new N+1 looks like)
+#   - in debug mode (or with SQL_METRICS_HEADERS) the numbers come back as X-DB-* response headers (except on streamed responses,
+#     which are only counted once their body has been sent)
+#   - per-route histograms are served in Prometheus text format at /metrics
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class Histogram:
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value):
+    self.count += 1
+    self.sum += value
+
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[i] += 1
+
+# every metric is keyed by (name, labels), where labels is a tuple of (label, value) pairs
+class Registry:
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.histograms = {}
+    self.counters = {}
+    self.help = {}
+
+  def observe(self, name, labels, value, buckets):
+    with self._lock:
+      key = (name, labels)
+
+      if key not in self.histograms:
+        self.histograms[key] = Histogram(buckets)
+
+      self.histograms[key].observe(value)
+
+  def inc(self, name, labels=(), amount=1):
+    with self._lock:
+      key = (name, labels)
+      self.counters[key] = self.counters.get(key, 0) + amount
+
+  def describe(self, name, text):
+    self.help[name] = text
+
+registry = Registry()
+registry.describe('http_request_duration_seconds', 'Request latency by route.')
+registry.describe('http_request_queries', 'SQL statements per request by route.')
+registry.describe('http_request_db_seconds', 'Time spent executing SQL per request by route.')
+registry.describe('http_request_pool_wait_seconds', 'Time spent waiting for a pooled connection per request by route.')
+registry.describe('http_requests_over_query_budget_total', 'Requests that ran more SQL statements than QUERY_BUDGET.')
+registry.describe('db_pool_timeouts_total', 'Requests that gave up waiting for a pooled connection (DB_POOL_TIMEOUT).')
+
+def _stats():
+  if has_request_context():
+    return g.get('sql_stats')
+
+  return None
+
+# --- engine hooks: time each statement ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  elapsed = time.perf_counter() - conn.info['query_start'].pop()
+  stats = _stats()
+
+  if stats is None:
+    return
+
+  stats['queries'] += 1
+  stats['db_seconds'] += elapsed
+
+  if elapsed > stats['slowest_seconds']:
+    stats['slowest_seconds'] = elapsed
+    stats['slowest_statement'] = ' '.join(statement.split())[:200]
+
+# --- session hooks: time the wait for a pooled connection ---
+# A session checks a connection out of the pool when its transaction begins, right before its first statement or flush,
+# and gives it back when the transaction ends. So the wait is the time between the first of those and after_begin.
+
+def _before_work(session):
+  stats = _stats()
+
+  if stats is not None and not session.info.get('has_connection') and 'wait_start' not in stats:
+    stats['wait_start'] = time.perf_counter()
+
+def _before_execute(orm_execute_state):
+  _before_work(orm_execute_state.session)
+
+def _before_flush(session, flush_context, instances):
+  _before_work(session)
+
+def _after_begin(session, transaction, connection):
+  session.info['has_connection'] = True
+  stats = _stats()
+
+  if stats is not None and 'wait_start' in stats:
+    stats['pool_wait_seconds'] += time.perf_counter() - stats.pop('wait_start')
+
+def _after_transaction_end(session, transaction):
+  if transaction.parent is None:
+    session.info['has_connection'] = False
+
+# --- request hooks ---
+
+def _start_request():
+  g.request_start = time.perf_counter()
+  g.sql_stats = {
+    'queries': 0,
+    'db_seconds': 0.0,
+    'pool_wait_seconds': 0.0,
+    'slowest_seconds': 0.0,
+    'slowest_statement': None
+  }
+
+def _finish_request(response):
+  # a streamed body (stream_with_context) runs its queries while it's being sent, after this hook, and adds them into
+  # the same g.sql_stats, so it's recorded once the server closes the response instead, and gets no X-DB-* headers
+  if response.is_streamed:
+    stats = g.get('sql_stats')
+
+    if stats is not None:
+      app = current_app._get_current_object()
+      route = request.endpoint or 'unmatched'
+      start = g.request_start
+      response.call_on_close(lambda: _record(app, route, stats, start))
+
+    return response
+
+  stats = g.pop('sql_stats', None)
+
+  if stats is None:
+    return response
+
+  over_budget = _record(current_app, request.endpoint or 'unmatched', stats, g.request_start)
+
+  if current_app.debug or current_app.config['SQL_METRICS_HEADERS']:
+    response.headers['X-DB-Queries'] = str(stats['queries'])
+    response.headers['X-DB-Time-ms'] = '{:.2f}'.format(stats['db_seconds'] * 1000)
+    response.headers['X-DB-Pool-Wait-ms'] = '{:.2f}'.format(stats['pool_wait_seconds'] * 1000)
+    response.headers['X-DB-Slowest-ms'] = '{:.2f}'.format(stats['slowest_seconds'] * 1000)
+    if over_budget:
+      response.headers['X-DB-Over-Budget'] = '1'
+
+  return response
+
+# adds one finished request to the histograms and checks it against QUERY_BUDGET. Returns whether it went over
+def _record(app, route, stats, start):
+  labels = (('route', route),)
+  duration = time.perf_counter() - start
+
+  registry.observe('http_request_duration_seconds', labels, duration, DURATION_BUCKETS)
+  registry.observe('http_request_queries', labels, stats['queries'], QUERY_BUCKETS)
+  registry.observe('http_request_db_seconds', labels, stats['db_seconds'], DURATION_BUCKETS)
+  registry.observe('http_request_pool_wait_seconds', labels, stats['pool_wait_seconds'], DURATION_BUCKETS)
+
+  budget = app.config['QUERY_BUDGET']
+  over_budget = budget is not None and stats['queries'] > budget
+
+  if over_budget:
+    registry.inc('http_requests_over_query_budget_total', labels)
+    app.logger.warning(
+      '%s ran %d SQL statements (budget %d); slowest took %.1f ms: %s',
+      route, stats['queries'], budget, stats['slowest_seconds'] * 1000, stats['slowest_statement']
+    )
+
+  return over_budget
+
+# --- /metrics ---
+
+def _format_labels(labels):
+  if not labels:
+    return ''
+
+  return '{' + ','.join('{}="{}"'.format(key, value) for key, value in labels) + '}'
+
+def _with_label(labels, key, value):
+  return _format_labels(labels + ((key, value),))
+
+# numbers that other parts of the app already keep, read at scrape time as (name, type, help, value)
+def _snapshots():
+  snapshots = []
+
+  for name, pooled in all_engines():
+    pool = pooled.pool
+
+    if hasattr(pool, 'checkedout'):
+      labels = '{{engine="{}"}}'.format(name)
+      snapshots.append(('db_pool_checked_out' + labels, 'gauge', 'Connections currently checked out of the pool.', pool.checkedout()))
+      snapshots.append(('db_pool_size' + labels, 'gauge', 'Configured pool size.', pool.size()))
+
+  cache = current_app.extensions.get('fragment_cache')
+  if cache is not None:
+    cache_stats = cache.stats()
+    snapshots.append(('fragment_cache_hits_total', 'counter', 'Post fragment cache hits.', cache_stats['hits']))
+    snapshots.append(('fragment_cache_misses_total', 'counter', 'Post fragment cache misses.', cache_stats['misses']))
+
+  password_stats = passwords.stats()
+  snapshots.append(('password_hash_queue_depth', 'gauge', 'Password hashes in flight.', password_stats['queue_depth']))
+  snapshots.append(('password_hash_avg_seconds', 'gauge', 'Average password hash latency.', password_stats['avg_seconds']))
+
+  queue = current_app.extensions.get('vote_queue')
+  if queue is not None:
+    snapshots.append(('vote_queue_depth', 'gauge', 'Votes waiting to be flushed.', queue.depth()))
+
+  admission = current_app.extensions.get('admission')
+  if admission is not None:
+    for route_class, gate in sorted(admission['gates'].items()):
+      labels = '{{class="{}"}}'.format(route_class)
+      snapshots.append(('admission_active' + labels, 'gauge', 'Requests running, by route class.', gate.active))
+      snapshots.append(('admission_waiting' + labels, 'gauge', 'Requests queued for admission, by route class.', gate.waiting))
+
+  hub = current_app.extensions.get('event_hub')
+  if hub is not None:
+    hub_stats = hub.stats()
+    snapshots.append(('events_subscribers', 'gauge', 'Open /api/events streams.', hub_stats['subscribers']))
+    snapshots.append(('events_published_total', 'counter', 'Live update events published.', hub_stats['published']))
+    snapshots.append(('events_overflows_total', 'counter', 'Times a slow subscriber fell too far behind and was reset.', hub_stats['overflows']))
+
+  return snapshots
+
+def render_metrics():
+  lines = []
+
+  with registry._lock:
+    histograms = sorted(registry.histograms.items())
+    counters = sorted(registry.counters.items())
+
+  described = set()
+  for (name, labels), histogram in histograms:
+    if name not in described:
+      lines.append('# HELP {} {}'.format(name, registry.help.get(name, name)))
+      lines.append('# TYPE {} histogram'.format(name))
+      described.add(name)
+
+    for bound, count in zip(histogram.buckets, histogram.counts):
+      lines.append('{}_bucket{} {}'.format(name, _with_label(labels, 'le', bound), count))
+    lines.append('{}_bucket{} {}'.format(name, _with_label(labels, 'le', '+Inf'), histogram.count))
+    lines.append('{}_sum{} {}'.format(name, _format_labels(labels), histogram.sum))
+    lines.append('{}_count{} {}'.format(name, _format_labels(labels), histogram.count))
+
+  for (name, labels), value in counters:
+    if name not in described:
+      lines.append('# HELP {} {}'.format(name, registry.help.get(name, name)))
+      lines.append('# TYPE {} counter'.format(name))
+      described.add(name)
+
+    lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+
+  for name, kind, text, value in _snapshots():
+    base = name.split('{')[0]
+
+    if base not in described:
+      lines.append('# HELP {} {}'.format(base, text))
+      lines.append('# TYPE {} {}'.format(base, kind))
+      described.add(base)
+
+    lines.append('{} {}'.format(name, value))
+
+  return '\n'.join(lines) + '\n'
+
+def metrics():
+  return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# every connection in the pool stayed busy for DB_POOL_TIMEOUT seconds: count it and tell the client to come back shortly
+def pool_timeout(e):
+  registry.inc('db_pool_timeouts_total', (('route', request.endpoint or 'unmatched'),))
+
+  response = jsonify(message = 'Database busy, try again shortly')
+  response.status_code = 503
+  response.headers['Retry-After'] = '1'
+
+  return response
+
+# create_app() calls init_metrics() once the config is loaded, the same way it calls init_db()
+def init_metrics(app):
+  # the engine and session hooks are process-wide, so only attach them once even if several apps get created.
+  # Every engine gets the statement hooks, replicas included, so the @read_only routes are counted too
+  for _, pooled in all_engines():
+    if not event.contains(pooled, 'before_cursor_execute', _before_cursor_execute):
+      event.listen(pooled, 'before_cursor_execute', _before_cursor_execute)
+      event.listen(pooled, 'after_cursor_execute', _after_cursor_execute)
+
+  if not event.contains(Session, 'do_orm_execute', _before_execute):
+    event.listen(Session, 'do_orm_execute', _before_execute)
+    event.listen(Session, 'before_flush', _before_flush)
+    event.listen(Session, 'after_begin', _after_begin)
+    event.listen(Session, 'after_transaction_end', _after_transaction_end)
+
+  app.before_request(_start_request)
+  app.after_request(_finish_request)
+  app.add_url_rule('/metrics', 'metrics', metrics)
+  app.register_error_handler(PoolTimeoutError, pool_timeout)
@@ -0,0 +1,112 @@
+import threading
+import time
+import bcrypt
+
+# bcrypt is deliberately slow, so hashing and checking passwords on the request thread lets a burst of logins pin every worker's CPU.
+# Instead, the work is handed to a small pool of worker processes. The request thread waits for the answer,
+# but at most PASSWORD_HASH_MAX_PENDING hashes can be queued at once; past that, callers get PasswordQueueFull right away.
+# Each hash gets its own salt, generated with the configured cost (BCRYPT_ROUNDS), and passwords hashed with an
+# older cost are rehashed the next time their owner logs in.
+settings = {
+  'rounds': 12,
+  'workers': 2,
+  'max_pending': 64
+}
+
+class PasswordQueueFull(Exception):
+  pass
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(settings['max_pending'])
+_stats_lock = threading.Lock()
+_stats = {
+  'in_flight': 0,
+  'completed': 0,
+  'rejected': 0,
+  'total_seconds': 0.0,
+  'max_seconds': 0.0
+}
+
+# create_app() calls configure() with the app's settings. workers=0 hashes inline on the calling thread
+def configure(rounds=12, workers=2, max_pending=64):
+  global _slots
+
+  settings.update(rounds=rounds, workers=workers, max_pending=max_pending)
+  _slots = threading.BoundedSemaphore(max_pending)
+
+# the pool is only started when the first password is hashed, so importing this module or creating the app costs nothing
+def _get_executor():
+  global _executor
+
+  if _executor is None:
+    with _executor_lock:
+      if _executor is None:
+        # importing the process pool pulls in multiprocessing, which is worth keeping off the startup path too
+        from concurrent.futures import ProcessPoolExecutor
+
+        _executor = ProcessPoolExecutor(max_workers=settings['workers'])
+
+  return _executor
+
+# these two run inside the worker processes, so they take and return plain bytes/str/bool
+def _hash(password, rounds):
+  return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+def _check(password, hashed):
+  return bcrypt.checkpw(password, hashed)
+
+def _run(func, *args):
+  if not _slots.acquire(blocking=False):
+    with _stats_lock:
+      _stats['rejected'] += 1
+    raise PasswordQueueFull('Too many passwords waiting to be hashed')
+
+  with _stats_lock:
+    _stats['in_flight'] += 1
+
+  start = time.perf_counter()
+  try:
+    if settings['workers']:
+      return _get_executor().submit(func, *args).result()
+
+    return func(*args)
+  finally:
+    elapsed = time.perf_counter() - start
+    _slots.release()
+
+    with _stats_lock:
+      _stats['in_flight'] -= 1
+      _stats['completed'] += 1
+      _stats['total_seconds'] += elapsed
+      _stats['max_seconds'] = max(_stats['max_seconds'], elapsed)
+
+def _to_bytes(value):
+  return value if isinstance(value, bytes) else value.encode('utf-8')
+
+def hash_password(password):
+  return _run(_hash, _to_bytes(password), settings['rounds'])
+
+def check_password(password, hashed):
+  return _run(_check, _to_bytes(password), _to_bytes(hashed))
+
+# a bcrypt hash looks like $2b$12$<salt+hash>, where 12 is the cost it was made with
+def needs_rehash(hashed):
+  try:
+    return int(_to_bytes(hashed).split(b'$')[2]) != settings['rounds']
+  except (IndexError, ValueError):
+    return True
+
+def stats():
+  with _stats_lock:
+    completed = _stats['completed']
+
+    return {
+      'queue_depth': _stats['in_flight'],
+      'completed': completed,
+      'rejected': _stats['rejected'],
+      'avg_seconds': _stats['total_seconds'] / completed if completed else 0.0,
+      'max_seconds': _stats['max_seconds'],
+      'rounds': settings['rounds'],
+      'workers': settings['workers']
+    }
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+from flask import g, current_app
+from sqlalchemy.orm import joinedload
+from app.models import Post, Comment
+from app.utils.feed import paginate
+from app.utils import versions
+
+# comments are shown COMMENT_PAGE_SIZE at a time, oldest or newest first, paged through (created_at, id) with the keyset cursor
+COMMENT_PAGE_SIZE = 50
+COMMENT_SORT = [Comment.created_at, Comment.id]
+# ordering name -> whether it sorts descending
+COMMENT_ORDERS = {
+  'oldest': False,
+  'newest': True
+}
+
+# one page of a post's comments with their authors, joined in the same query, as (comments, next_cursor)
+def load_comments(db, post_id, order='oldest', after=None, limit=COMMENT_PAGE_SIZE):
+  comments, next_cursor = paginate(
+    db.query(Comment).options(joinedload(Comment.user)).filter(Comment.post_id == post_id),
+    COMMENT_SORT,
+    after=after,
+    limit=limit,
+    descending=COMMENT_ORDERS[order]
+  )
+
+  return [
+    SimpleNamespace(
+      id=comment.id,
+      comment_text=comment.comment_text,
+      user=SimpleNamespace(username=comment.user.username),
+      created_at=comment.created_at
+    )
+    for comment in comments
+  ], next_cursor
+
+# The single-post and edit pages show a post, its author and a page of comments with their authors.
+# load_post_view() fetches the post and author in one query and the first page of comments (oldest first) in a second,
+# then copies it into plain objects that templates read exactly like the ORM models.
+# Being detached from any session, those objects can be kept in the post view cache and shared between requests.
+# However many comments a post has, a view never holds more than one page of them
+def load_post_view(db, post_id):
+  post = (
+    db.query(Post)
+    .options(joinedload(Post.user))
+    .filter(Post.id == post_id)
+    .one()
+  )
+  comments, comments_cursor = load_comments(db, post.id)
+
+  return SimpleNamespace(
+    id=post.id,
+    title=post.title,
+    post_url=post.post_url,
+    domain=post.domain,
+    user_id=post.user_id,
+    user=SimpleNamespace(username=post.user.username),
+    vote_count=post.vote_count,
+    comment_count=post.comment_count,
+    created_at=post.created_at,
+    updated_at=post.updated_at,
+    comments=comments,
+    comments_order='oldest',
+    comments_cursor=comments_cursor
+  )
+
+# the post's version stamp, as read by @conditional for this request's ETag, or read here for routes without one
+def _post_version(db, post_id):
+  key = versions.post_key(int(post_id))
+  stamps = g.get('version_stamps')
+
+  if stamps is None or key not in stamps:
+    stamps = versions.read(db, [key])
+
+  return stamps.get(key, (0, None))[0]
+
+# read-through: serve the assembled view from the cache, or load it and remember it.
+# Each entry is stored with the version stamp of the post it was built from. A write in any process bumps that stamp,
+# so an entry older than the post's current stamp is reloaded instead of being served (under an ETag made from the newer stamp)
+# until its TTL runs out. The write routes of this process also drop the entry straight away through invalidate_post().
+# That also keeps read-your-writes (see _choose_engine() in app/db) working through the cache: a view refilled from a lagging
+# replica carries the replica's older stamp, so the writer, reading the stamp from the primary, reloads it from the primary.
+# Only the default first page of comments is cached; asking for another order or page (a KeyError or ValueError when invalid)
+# reuses the cached post and loads just those comments
+def get_post_view(db, post_id, order='oldest', after=None):
+  cache = current_app.extensions.get('post_view_cache')
+
+  if cache is None:
+    view = load_post_view(db, post_id)
+  else:
+    key = str(int(post_id))
+    version = _post_version(db, post_id)
+    entry = cache.get(key)
+
+    if entry is not None and entry[0] >= version:
+      view = entry[1]
+    else:
+      view = load_post_view(db, post_id)
+
+      # a request reading from a lagging replica sees an older stamp; its view mustn't replace a newer one another request cached meanwhile
+      latest = cache.get(key)
+      if latest is None or latest[0] <= version:
+        cache.set(key, (version, view))
+
+  if order == view.comments_order and not after:
+    return view
+
+  comments, comments_cursor = load_comments(db, view.id, order, after)
+
+  return SimpleNamespace(**dict(vars(view), comments=comments, comments_order=order, comments_cursor=comments_cursor))
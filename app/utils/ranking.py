@@ -0,0 +1,109 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+from app.db import Session
+from app.models import Post
+from app.utils import versions
+
+# "hot" ranking, Hacker News style: a post's points are divided by its age raised to a gravity exponent,
+# so new activity lifts a post and time slowly pulls it back down.
+# The score is stored in Post.hot_score (indexed together with id) so the hot feed is a plain range scan over the index.
+GRAVITY = 1.8
+COMMENT_WEIGHT = 0.5
+
+# posts older than this are no longer worth re-decaying; their score is pinned to 0 and they drop to the bottom of the hot feed
+MAX_AGE = timedelta(days=7)
+
+def hot_score(vote_count, comment_count, created_at, now=None):
+  now = now or datetime.now()
+  age_hours = max((now - created_at).total_seconds(), 0) / 3600
+  points = vote_count + comment_count * COMMENT_WEIGHT
+
+  return points / pow(age_hours + 2, GRAVITY)
+
+# update_scores() recomputes the score of a few posts from their stored counters.
+# The write routes call it after bumping a counter and before db.commit(), so the score is saved together with the vote or comment
+def update_scores(db, post_ids, now=None):
+  rows = (
+    db.query(Post.id, Post.vote_count, Post.comment_count, Post.created_at)
+    .filter(Post.id.in_(post_ids))
+    .all()
+  )
+
+  _save_scores(db, rows, now)
+
+def update_score(db, post_id, now=None):
+  update_scores(db, [post_id], now)
+
+def _save_scores(db, rows, now=None):
+  if not rows:
+    return
+
+  # one executemany UPDATE for the whole batch. A new score isn't an edit of the post,
+  # so updated_at is set to itself to keep the column's onupdate from moving it
+  db.execute(
+    Post.__table__.update()
+    .where(Post.__table__.c.id == bindparam('post_id'))
+    .values(hot_score=bindparam('score'), updated_at=Post.__table__.c.updated_at),
+    [
+      { 'post_id': row.id, 'score': hot_score(row.vote_count, row.comment_count, row.created_at, now) }
+      for row in rows
+    ]
+  )
+
+# decay_scores() is the periodic job: scores only change on writes, so without it a post that stops getting votes would keep its score forever.
+# Recent posts are recomputed in id-ordered chunks, and anything older than MAX_AGE is pinned to 0 in one UPDATE
+def decay_scores(db, chunk_size=1000, now=None):
+  now = now or datetime.now()
+  cutoff = now - MAX_AGE
+  updated = 0
+  last_id = 0
+
+  while True:
+    rows = (
+      db.query(Post.id, Post.vote_count, Post.comment_count, Post.created_at)
+      .filter(Post.created_at >= cutoff, Post.id > last_id)
+      .order_by(Post.id)
+      .limit(chunk_size)
+      .all()
+    )
+
+    if not rows:
+      break
+
+    _save_scores(db, rows, now)
+    db.commit()
+
+    updated += len(rows)
+    last_id = rows[-1].id
+
+  db.query(Post).filter(Post.created_at < cutoff, Post.hot_score != 0).update(
+    {Post.hot_score: 0, Post.updated_at: Post.updated_at},
+    synchronize_session=False
+  )
+  # the hot feed's order just changed without any write, so its cached copies are stale
+  versions.bump(db)
+  db.commit()
+
+  return updated
+
+# runs decay_scores() on a daemon thread every `interval` seconds, with its own session, for a single-process deployment that doesn't schedule `flask decay-scores`
+def start_decay_worker(interval):
+  def run():
+    while True:
+      time.sleep(interval)
+
+      db = Session()
+      try:
+        decay_scores(db)
+      except Exception as e:
+        print('Hot score decay failed: {}'.format(e))
+        db.rollback()
+      finally:
+        db.close()
+
+  worker = threading.Thread(target=run, name='hot-score-decay', daemon=True)
+  worker.start()
+
+  return worker
@@ -0,0 +1,191 @@
+import hashlib
+from functools import lru_cache
+from sqlalchemy import inspect, UniqueConstraint
+from sqlalchemy.schema import CreateTable, CreateIndex, CreateColumn
+from app.db import Base
+from app.models import SchemaVersion
+
+# Schema management for deployments that start workers with DB_CREATE_ALL=0.
+#
+# `flask migrate` compares the database with the models and applies what's missing: new tables, new columns on existing tables
+# (ALTER TABLE ... ADD COLUMN, so a new column needs to be nullable or have a server_default), new indexes and unique constraints
+# (added as unique indexes, which every database can add to an existing table), and longer string columns where the database
+# can widen them in place. It never drops anything. Differences it can't apply safely, like a column whose type changed kind,
+# are reported as needing a manual change, and then no fingerprint is recorded.
+# Once the database matches, it records the models' fingerprint, a hash of their tables, columns and indexes, in the schema_versions table.
+# `flask verify-schema` then only has to compare that stored fingerprint with the current one; when they differ, or with --deep,
+# it inspects the database and lists every difference.
+
+# bumped whenever plan() learns to compare something new, so databases migrated by an older plan() get inspected again
+PLAN_VERSION = 2
+
+# A hash of what the models define for one dialect: every table's columns with their compiled types, and its keys,
+# unique constraints and indexes, each listed in a fixed order (CREATE TABLE lists constraints in an order that changes
+# from one process to the next). Computed once per dialect and process
+@lru_cache(maxsize=None)
+def _fingerprint(dialect):
+  lines = ['plan {}'.format(PLAN_VERSION)]
+
+  for table in Base.metadata.sorted_tables:
+    lines.append('table {}'.format(table.name))
+    lines += [
+      'column {} {} {} {} {}'.format(
+        column.name, column.type.compile(dialect=dialect), column.nullable, column.primary_key,
+        column.server_default.arg if column.server_default is not None else None
+      )
+      for column in table.columns
+    ]
+    lines += sorted('foreign key {} {}'.format(key.parent.name, key.target_fullname) for key in table.foreign_keys)
+    lines += sorted(
+      'unique {} {}'.format(constraint.name, list(constraint.columns.keys())) for constraint in _unique_constraints(table)
+    )
+    lines += sorted(
+      'index {} {} {}'.format(index.name, [column.name for column in index.columns], index.unique) for index in table.indexes
+    )
+
+  return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+def fingerprint(bind):
+  return _fingerprint(bind.dialect)
+
+# the fingerprint recorded by the last `flask migrate`, or None if there hasn't been one
+def stored_fingerprint(conn):
+  if not inspect(conn).has_table(SchemaVersion.__tablename__):
+    return None
+
+  row = conn.execute(
+    SchemaVersion.__table__.select().order_by(SchemaVersion.id.desc()).limit(1)
+  ).first()
+
+  return row.fingerprint if row else None
+
+# what the database is missing compared with the models, as a list of (description, DDL) in the order to apply them.
+# The DDL is None for differences migrate() can't apply by itself
+def plan(conn):
+  inspector = inspect(conn)
+  existing = set(inspector.get_table_names())
+  steps = []
+
+  for table in Base.metadata.sorted_tables:
+    if table.name not in existing:
+      steps.append(('create table {}'.format(table.name), CreateTable(table)))
+      steps += [('create index {}'.format(index.name), CreateIndex(index)) for index in table.indexes]
+      continue
+
+    columns = { column['name']: column for column in inspector.get_columns(table.name) }
+    for column in table.columns:
+      if column.name not in columns:
+        steps.append(('add column {}.{}'.format(table.name, column.name), _add_column(conn, table, column)))
+      else:
+        steps += _column_type_steps(conn, table, column, columns[column.name]['type'])
+
+    indexes = inspector.get_indexes(table.name)
+    index_names = { index['name'] for index in indexes }
+    for index in sorted(table.indexes, key=lambda index: index.name):
+      if index.name not in index_names:
+        steps.append(('create index {}'.format(index.name), CreateIndex(index)))
+
+    # a unique constraint is there if the database enforces uniqueness over the same columns, as a constraint or a unique index
+    unique = [set(constraint['column_names']) for constraint in inspector.get_unique_constraints(table.name)]
+    unique += [set(index['column_names']) for index in indexes if index.get('unique')]
+    for constraint in sorted(_unique_constraints(table), key=lambda constraint: constraint.name):
+      if set(constraint.columns.keys()) not in unique:
+        steps.append(('add unique constraint {}'.format(constraint.name), _add_unique(conn, table, constraint)))
+
+  return steps
+
+def _unique_constraints(table):
+  return [constraint for constraint in table.constraints if isinstance(constraint, UniqueConstraint) and constraint.name]
+
+def _add_column(conn, table, column):
+  preparer = conn.dialect.identifier_preparer
+
+  return 'ALTER TABLE {} ADD COLUMN {}'.format(
+    preparer.format_table(table),
+    CreateColumn(column).compile(dialect=conn.dialect)
+  )
+
+# written out by hand: an Index() built from the constraint's columns would attach itself to the model's table
+def _add_unique(conn, table, constraint):
+  preparer = conn.dialect.identifier_preparer
+
+  return 'CREATE UNIQUE INDEX {} ON {} ({})'.format(
+    preparer.quote(constraint.name),
+    preparer.format_table(table),
+    ', '.join(preparer.format_column(column) for column in constraint.columns)
+  )
+
+# compares a column's type in the database with the model's.
+# A string that got longer can be widened in place on PostgreSQL and MySQL; SQLite doesn't enforce string lengths at all.
+# Anything else, like a different kind of type, is left for a person to change
+def _column_type_steps(conn, table, column, db_type):
+  dialect = conn.dialect
+  model_type = column.type
+  name = '{}.{}'.format(table.name, column.name)
+  wanted = model_type.compile(dialect=dialect)
+
+  if db_type._type_affinity is not model_type._type_affinity:
+    return [('column {} is {}, models want {} (needs a manual change)'.format(name, db_type, wanted), None)]
+
+  db_length = getattr(db_type, 'length', None)
+  model_length = getattr(model_type, 'length', None)
+
+  if db_length == model_length or dialect.name == 'sqlite':
+    return []
+
+  description = 'change column {} from {} to {}'.format(name, db_type, wanted)
+  preparer = dialect.identifier_preparer
+
+  if db_length is not None and (model_length is None or model_length > db_length):
+    if dialect.name == 'postgresql':
+      return [(description, 'ALTER TABLE {} ALTER COLUMN {} TYPE {}'.format(
+        preparer.format_table(table), preparer.format_column(column), wanted
+      ))]
+    if dialect.name == 'mysql':
+      return [(description, 'ALTER TABLE {} MODIFY COLUMN {}'.format(
+        preparer.format_table(table), CreateColumn(column).compile(dialect=dialect)
+      ))]
+
+  # shrinking a column could cut off stored values
+  return [(description + ' (needs a manual change)', None)]
+
+# applies plan() in one transaction (where the database allows DDL in transactions) and, if nothing was left over,
+# records the fingerprint. Returns the descriptions of the steps it applied and of those that need a manual change
+def migrate(engine, dry_run=False):
+  with engine.begin() as conn:
+    steps = plan(conn)
+    applied = [description for description, ddl in steps if ddl is not None]
+    manual = [description for description, ddl in steps if ddl is None]
+
+    if dry_run:
+      return applied, manual
+
+    for description, ddl in steps:
+      if isinstance(ddl, str):
+        conn.exec_driver_sql(ddl)
+      elif ddl is not None:
+        conn.execute(ddl)
+
+    current = fingerprint(conn)
+    if not manual and (steps or stored_fingerprint(conn) != current):
+      conn.execute(SchemaVersion.__table__.insert().values(fingerprint=current))
+
+  return applied, manual
+
+# returns (ok, problems). With a matching stored fingerprint that's a quick lookup, unless `deep` asks for a full comparison anyway
+def verify(engine, deep=False):
+  with engine.connect() as conn:
+    current = fingerprint(conn)
+    stored = stored_fingerprint(conn)
+
+    if stored == current and not deep:
+      return True, []
+
+    problems = [description for description, ddl in plan(conn)]
+
+  if stored is None:
+    problems.append('no `flask migrate` recorded')
+  elif stored != current and not problems:
+    problems.append('fingerprint {} was recorded, models are at {}'.format(stored[:12], current[:12]))
+
+  return not problems, problems
@@ -0,0 +1,132 @@
+import re
+from collections import Counter
+from sqlalchemy import bindparam, func, select
+from app.db import insert_ignore
+from app.models import Post, Comment, SearchTerm
+from app.utils.feed import FEED_PAGE_SIZE, decode_cursor, encode_cursor, keyset_filter
+
+# Search runs on our own inverted index (the search_terms table) instead of LIKE '%term%' scans over titles and comments,
+# which can't use an index and read every row. It works the same on SQLite, MySQL and PostgreSQL.
+#
+# The write routes keep it in sync as they go: a new post adds its title's words, a comment adds its words to the post,
+# an edit swaps the old title's words for the new ones, and deleting a post deletes its rows.
+# `flask rebuild-search-index` recomputes the whole thing from the posts and comments tables.
+TITLE_WEIGHT = 3
+MAX_TERM_LENGTH = 50
+MAX_QUERY_TERMS = 8
+STOP_WORDS = {
+  'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or', 'the', 'this', 'to', 'was', 'with'
+}
+
+# splits text into lowercase words, leaving out one-letter words and stop words that would match nearly every post
+def tokenize(text):
+  return [
+    word[:MAX_TERM_LENGTH] for word in re.findall(r'\w+', (text or '').lower())
+    if len(word) > 1 and word not in STOP_WORDS
+  ]
+
+def title_terms(title):
+  return Counter({ term: count * TITLE_WEIGHT for term, count in Counter(tokenize(title)).items() })
+
+def comment_terms(text):
+  return Counter(tokenize(text))
+
+# applies weight changes, given as { post_id: Counter({ term: delta }) }, in a fixed number of statements however many posts are involved:
+# an insert-ignore creating any missing (term, post) rows, one executemany UPDATE adding the deltas, and a DELETE of rows that dropped to zero
+def index_terms(db, changes):
+  rows = [
+    { 't': term, 'p': post_id, 'n': delta }
+    for post_id, terms in changes.items() for term, delta in terms.items() if delta
+  ]
+
+  if not rows:
+    return
+
+  table = SearchTerm.__table__
+
+  db.execute(insert_ignore(db, table), [{ 'term': row['t'], 'post_id': row['p'], 'weight': 0 } for row in rows])
+  db.execute(
+    table.update()
+    .where(table.c.term == bindparam('t'))
+    .where(table.c.post_id == bindparam('p'))
+    .values(weight=table.c.weight + bindparam('n')),
+    rows
+  )
+
+  shrunk = { row['p'] for row in rows if row['n'] < 0 }
+  if shrunk:
+    db.execute(table.delete().where(table.c.post_id.in_(shrunk)).where(table.c.weight <= 0))
+
+def index_post(db, post_id, title):
+  index_terms(db, { post_id: title_terms(title) })
+
+def index_comment(db, post_id, comment_text):
+  index_terms(db, { post_id: comment_terms(comment_text) })
+
+def reindex_title(db, post_id, old_title, new_title):
+  changes = title_terms(new_title)
+  changes.subtract(title_terms(old_title))
+
+  index_terms(db, { post_id: changes })
+
+def unindex_post(db, post_id):
+  db.query(SearchTerm).filter(SearchTerm.post_id == post_id).delete(synchronize_session=False)
+
+# rebuilds the whole index, walking the posts in id ranges and committing after each chunk
+def rebuild_index(db, chunk_size=1000):
+  db.query(SearchTerm).delete(synchronize_session=False)
+  db.commit()
+
+  max_id = db.query(func.max(Post.id)).scalar() or 0
+  indexed = 0
+
+  for start in range(0, max_id + 1, chunk_size):
+    in_chunk = lambda column: (column >= start) & (column < start + chunk_size)
+    changes = {}
+
+    for post_id, title in db.query(Post.id, Post.title).filter(in_chunk(Post.id)):
+      changes[post_id] = title_terms(title)
+
+    for post_id, comment_text in db.query(Comment.post_id, Comment.comment_text).filter(in_chunk(Comment.post_id)):
+      if post_id in changes:
+        changes[post_id].update(comment_terms(comment_text))
+
+    index_terms(db, changes)
+    db.commit()
+    indexed += len(changes)
+
+  return indexed
+
+# One page of results for a query string, best matches first, as (posts, scores, next_cursor).
+# A post matches when it contains every term; its score is the sum of their weights, and ties go to the newer post.
+# Paging uses the same keyset cursor as the feeds, over (score, post id)
+def search(db, q, after=None, limit=FEED_PAGE_SIZE, options=()):
+  terms = list(dict.fromkeys(tokenize(q)))[:MAX_QUERY_TERMS]
+
+  if not terms:
+    return [], {}, None
+
+  score = func.sum(SearchTerm.weight)
+  columns = [score, SearchTerm.post_id]
+
+  query = (
+    select([SearchTerm.post_id, score.label('score')])
+    .where(SearchTerm.term.in_(terms))
+    .group_by(SearchTerm.post_id)
+    .having(func.count(SearchTerm.term) == len(terms))
+  )
+
+  if after:
+    query = query.having(keyset_filter(columns, decode_cursor(after, columns)))
+
+  matches = db.execute(query.order_by(score.desc(), SearchTerm.post_id.desc()).limit(limit + 1)).all()
+
+  next_cursor = None
+  if len(matches) > limit:
+    matches = matches[:limit]
+    next_cursor = encode_cursor([matches[-1].score, matches[-1].post_id])
+
+  scores = { match.post_id: match.score for match in matches }
+  posts = { post.id: post for post in db.query(Post).options(*options).filter(Post.id.in_(scores)) } if scores else {}
+
+  return [posts[post_id] for post_id in scores if post_id in posts], scores, next_cursor
@@ -0,0 +1,77 @@
+import json
+from datetime import datetime
+from flask import Response, request, current_app, stream_with_context
+from app.utils.feed import FEED_PAGE_SIZE, page_query, encode_cursor, decode_cursor
+
+# The JSON read routes select only the columns a client asks for, page through them with the keyset cursor from app/utils/feed.py,
+# and stream the page out as the rows arrive instead of building one big list of ORM objects and one big JSON string.
+# A page of 1,000 posts is then a single range scan over a handful of columns, and memory stays flat however large the page is.
+
+# ?fields=id,title picks columns out of `available` (a dict of field name -> column); no ?fields= means `default`.
+# An unknown field raises a ValueError, which the routes turn into a 400
+def select_fields(available, default):
+  requested = request.args.get('fields')
+
+  if not requested:
+    return list(default)
+
+  fields = []
+  for field in requested.split(','):
+    field = field.strip()
+
+    if field not in available:
+      raise ValueError('Unknown field: {}'.format(field))
+    if field not in fields:
+      fields.append(field)
+
+  return fields
+
+# ?limit= defaults to one feed page (or `default`) and is capped at API_PAGE_MAX_SIZE
+def page_limit(default=FEED_PAGE_SIZE):
+  limit = request.args.get('limit', default, type=int)
+
+  if limit is None or limit < 1:
+    raise ValueError('Invalid limit')
+
+  return min(limit, current_app.config['API_PAGE_MAX_SIZE'])
+
+def _json_value(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+
+  return value
+
+# Builds the column-only query for one page and returns a streaming response of the form
+#   { "<name>": [ {...}, {...} ], "next_cursor": "..." }
+# `query` is a function that receives the labelled columns to select and returns the (unsorted) query to run them in.
+# The sort columns are selected too, under their own labels, so the next cursor can be built whichever fields were asked for.
+# The cursor is checked here, before streaming starts, so a bad one is still a proper 400
+def stream_page(name, query, available, fields, sort_columns, after=None, limit=FEED_PAGE_SIZE, descending=True):
+  if after:
+    decode_cursor(after, sort_columns)
+
+  selected = [available[field].label(field) for field in fields]
+  selected += [column.label('sort_{}'.format(i)) for i, column in enumerate(sort_columns)]
+  sort_keys = ['sort_{}'.format(i) for i in range(len(sort_columns))]
+
+  rows = page_query(query(selected), sort_columns, after, limit, descending).yield_per(min(limit + 1, 500))
+
+  def generate():
+    yield '{{"{}":['.format(name)
+
+    last = None
+    next_cursor = None
+
+    for count, row in enumerate(rows):
+      # the extra row page_query() asked for: there's another page, which starts after the last row we sent
+      if count == limit:
+        next_cursor = encode_cursor([getattr(last, key) for key in sort_keys])
+        break
+
+      item = { field: _json_value(getattr(row, field)) for field in fields }
+      yield (',' if count else '') + json.dumps(item)
+      last = row
+
+    yield '],"next_cursor":{}}}'.format(json.dumps(next_cursor))
+
+  return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,33 @@
+from datetime import datetime
+from sqlalchemy import bindparam
+from app.db import insert_ignore
+from app.models import ContentVersion
+
+GLOBAL = 'global'
+
+def post_key(post_id):
+  return 'post:{}'.format(post_id)
+
+# bump() moves the feed's version, plus the version of each given post, forward by one.
+# Call it before db.commit() so the stamp changes in the same transaction as the content it describes.
+# It's always two statements however many posts are involved: an insert-ignore that creates any rows that don't exist yet,
+# then an executemany UPDATE that increments them all
+def bump(db, post_ids=()):
+  # keys are always bumped in the same order, so two transactions bumping the same rows can't deadlock
+  keys = [GLOBAL] + [post_key(post_id) for post_id in sorted({ int(post_id) for post_id in post_ids })]
+  table = ContentVersion.__table__
+  now = datetime.utcnow()
+
+  db.execute(insert_ignore(db, table), [{ 'key': key, 'version': 0, 'updated_at': now } for key in keys])
+  db.execute(
+    table.update()
+    .where(table.c.key == bindparam('k'))
+    .values(version=table.c.version + 1, updated_at=now),
+    [{ 'k': key } for key in keys]
+  )
+
+# returns {key: (version, updated_at)} for the keys that have been bumped at least once, in one query
+def read(db, keys):
+  rows = db.query(ContentVersion).filter(ContentVersion.key.in_(keys)).all()
+
+  return { row.key: (row.version, row.updated_at) for row in rows }
@@ -0,0 +1,191 @@
+import atexit
+import threading
+from flask import current_app
+from sqlalchemy import bindparam, func, select
+from app.db import Session, insert_ignore
+from app.models import Vote, Post
+from app.utils import counters, ranking, versions, events
+from app.utils.cache import invalidate_post
+
+# Upvotes can be written two ways:
+#   - synchronously (the default): the request inserts its vote and commits, exactly like before
+#   - write-behind (VOTE_WRITE_BEHIND=True): the request only drops (user_id, post_id) into an in-memory queue and returns 202.
+#     A background thread flushes the queue as one multi-row INSERT once it holds VOTE_BATCH_SIZE votes or every VOTE_FLUSH_INTERVAL seconds,
+#     so a burst of clicks costs one pooled connection and one commit instead of one per click.
+# Either way the unique (user_id, post_id) constraint on votes makes repeated upvotes a no-op.
+
+# inserts a list of (user_id, post_id) pairs in one statement and returns how many were new
+def insert_votes(db, pairs):
+  if not pairs:
+    return 0
+
+  result = db.execute(
+    insert_ignore(db, Vote.__table__),
+    [{ 'user_id': user_id, 'post_id': post_id } for user_id, post_id in pairs]
+  )
+
+  return result.rowcount
+
+# synchronous upvote: insert the vote and, only if it's new, bump the post's counter and score (and its author's and voter's totals) in the same transaction.
+# Returns whether the vote was recorded; the caller commits
+def record_vote(db, user_id, post_id):
+  if not insert_votes(db, [(user_id, post_id)]):
+    return False
+
+  counters.add_vote(db, post_id)
+  counters.add_votes_received(db, { post_id: 1 })
+  counters.touch_users(db, [user_id])
+  ranking.update_score(db, post_id)
+  versions.bump(db, [post_id])
+
+  return True
+
+# Removes repeated votes, keeping each user's first vote on a post, so the unique (user_id, post_id) constraint can be added
+# to a votes table from before it existed (`flask dedupe-votes`, then `flask migrate`). The affected posts are rescored as it goes;
+# the command reconciles every stored counter afterwards. Returns how many rows were deleted
+def dedupe_votes(db, chunk_size=1000):
+  table = Vote.__table__
+  duplicates = db.execute(
+    select([table.c.user_id, table.c.post_id, func.min(table.c.id).label('keep')])
+    .group_by(table.c.user_id, table.c.post_id)
+    .having(func.count() > 1)
+  ).all()
+  deleted = 0
+
+  for start in range(0, len(duplicates), chunk_size):
+    chunk = duplicates[start:start + chunk_size]
+    result = db.execute(
+      table.delete()
+      .where(table.c.user_id == bindparam('u'))
+      .where(table.c.post_id == bindparam('p'))
+      .where(table.c.id != bindparam('keep')),
+      [{ 'u': row.user_id, 'p': row.post_id, 'keep': row.keep } for row in chunk]
+    )
+    deleted += result.rowcount
+
+    post_ids = sorted({ row.post_id for row in chunk if row.post_id is not None })
+    counters.recount_votes(db, post_ids)
+    ranking.update_scores(db, post_ids)
+    versions.bump(db, post_ids)
+    db.commit()
+
+  return deleted
+
+class VoteQueue:
+  def __init__(self, app, batch_size=500, flush_interval=1.0):
+    self.app = app
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    # pending votes, keyed by (user_id, post_id) so a user hammering the button only queues one vote
+    self._pending = {}
+    self._lock = threading.Lock()
+    self._wake = threading.Event()
+    self._flush_lock = threading.Lock()
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(target=self._run, name='vote-queue', daemon=True)
+    self._thread.start()
+    # don't lose whatever is still queued when the worker process shuts down
+    atexit.register(self.flush)
+
+  def add(self, user_id, post_id):
+    with self._lock:
+      self._pending[(user_id, post_id)] = True
+      full = len(self._pending) >= self.batch_size
+
+    if full:
+      self._wake.set()
+
+  def depth(self):
+    return len(self._pending)
+
+  def _run(self):
+    while True:
+      self._wake.wait(self.flush_interval)
+      self._wake.clear()
+
+      try:
+        self.flush()
+      except Exception as e:
+        print('Vote flush failed: {}'.format(e))
+
+  # writes everything queued so far in one transaction: a multi-row INSERT, then a recount and re-score of the affected posts
+  def flush(self):
+    with self._flush_lock:
+      with self._lock:
+        pairs = list(self._pending)
+        self._pending = {}
+
+      if not pairs:
+        return 0
+
+      with self.app.app_context():
+        db = Session()
+        try:
+          # the post may have been deleted since the vote was queued, and SQLite won't stop a vote pointing at nothing,
+          # so votes for posts that don't exist (any more) are dropped here
+          existing = { row.id for row in db.query(Post.id).filter(Post.id.in_({ post_id for _, post_id in pairs })) }
+          pairs = [(user_id, post_id) for user_id, post_id in pairs if post_id in existing]
+          post_ids = sorted(existing)
+
+          if not pairs:
+            return 0
+
+          try:
+            inserted = insert_votes(db, pairs)
+          except Exception as e:
+            # one bad vote (say, for a post that was just deleted) shouldn't sink the whole batch, so retry them one at a time
+            print('Batched vote insert failed, retrying individually: {}'.format(e))
+            db.rollback()
+            inserted = self._insert_individually(db, pairs)
+
+          counters.recount_votes(db, post_ids)
+          counters.recount_authors(db, post_ids)
+          counters.touch_users(db, { user_id for user_id, _ in pairs })
+          ranking.update_scores(db, post_ids)
+          versions.bump(db, post_ids)
+          db.commit()
+        except Exception:
+          db.rollback()
+          raise
+        finally:
+          db.close()
+
+        for post_id in post_ids:
+          invalidate_post(post_id)
+
+        db = Session()
+        try:
+          events.publish_counts(db, post_ids)
+        finally:
+          db.close()
+
+      return inserted
+
+  def _insert_individually(self, db, pairs):
+    inserted = 0
+
+    for pair in pairs:
+      try:
+        inserted += insert_votes(db, [pair])
+        db.commit()
+      except Exception as e:
+        print('Dropping vote {}: {}'.format(pair, e))
+        db.rollback()
+
+    return inserted
+
+# create_app() calls init_votes() to start the queue when write-behind mode is on
+def init_votes(app):
+  if app.config['VOTE_WRITE_BEHIND']:
+    queue = VoteQueue(
+      app,
+      batch_size=app.config['VOTE_BATCH_SIZE'],
+      flush_interval=app.config['VOTE_FLUSH_INTERVAL']
+    )
+    queue.start()
+    app.extensions['vote_queue'] = queue
+
+def get_vote_queue():
+  return current_app.extensions.get('vote_queue')
@@ -0,0 +1,226 @@
+# Route-level benchmark: drives every route of the home, dashboard and api blueprints through create_app()
+# against a freshly seeded local database, and reports throughput, p50/p95/p99 latency and SQL statements per request.
+#
+#   python -m benchmarks.routes                               # SQLite in a temp dir, small dataset
+#   python -m benchmarks.routes --posts 100000 --votes 1000000 --save baseline.json
+#   python -m benchmarks.routes --baseline baseline.json      # exits 1 if a route regressed
+#
+# A route regresses when it issues more SQL statements per request than in the baseline (a new N+1 shows up here right away),
+# or when its p95 latency grows by more than --tolerance. Run from the repository root; nothing but SQLite is needed.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description='Benchmark every route of the app.')
+  parser.add_argument('--db-url', help='database to seed and benchmark (defaults to a SQLite file in a temp dir)')
+  parser.add_argument('--users', type=int, default=1000)
+  parser.add_argument('--posts', type=int, default=5000)
+  parser.add_argument('--comments', type=int, default=20000)
+  parser.add_argument('--votes', type=int, default=50000)
+  parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+  parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per route before measuring')
+  parser.add_argument('--rounds', type=int, default=4, help='bcrypt cost, kept low so auth routes measure the app rather than bcrypt')
+  parser.add_argument('--routes', help='comma-separated route names to run (default: all)')
+  parser.add_argument('--save', help='write the results to this JSON file')
+  parser.add_argument('--baseline', help='compare against results saved earlier with --save')
+  parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative p95 latency growth over the baseline')
+
+  return parser.parse_args(argv)
+
+def percentile(values, pct):
+  ordered = sorted(values)
+
+  if not ordered:
+    return 0.0
+
+  index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+  return ordered[index]
+
+# Each scenario is (name, function). The function gets the test client and the iteration number, and makes exactly one request.
+# Write routes use the iteration number to pick a different target every time, so they keep doing real work
+def scenarios(first_post, last_post):
+  def post_id(i):
+    return first_post + i % (last_post - first_post + 1)
+
+  return [
+    ('home.index', lambda c, i: c.get('/')),
+    ('home.index?sort=hot', lambda c, i: c.get('/?sort=hot')),
+    ('home.login', lambda c, i: c.get('/login')),
+    ('home.single', lambda c, i: c.get('/post/{}'.format(post_id(i)))),
+    ('dashboard.dash', lambda c, i: c.get('/dashboard/')),
+    ('dashboard.edit', lambda c, i: c.get('/dashboard/edit/{}'.format(post_id(i)))),
+    ('api.stats', lambda c, i: c.get('/api/stats')),
+    ('api.posts', lambda c, i: c.get('/api/posts?limit=100')),
+    ('api.posts?fields=id', lambda c, i: c.get('/api/posts?limit=1000&fields=id')),
+    ('api.post_comments', lambda c, i: c.get('/api/posts/{}/comments'.format(post_id(i)))),
+    ('home.from_domain', lambda c, i: c.get('/from/github.com')),
+    ('home.search', lambda c, i: c.get('/search?q=python')),
+    ('api.search', lambda c, i: c.get('/api/search?q=flask+database')),
+    ('api.signup', lambda c, i: c.post('/api/users', json={
+      'username': 'bench{}'.format(i), 'email': 'bench{}@example.com'.format(i), 'password': 'password123'
+    })),
+    ('api.login', lambda c, i: c.post('/api/users/login', json={ 'email': 'user1@example.com', 'password': 'password123' })),
+    ('api.logout', lambda c, i: c.post('/api/users/logout')),
+    ('api.create', lambda c, i: c.post('/api/posts', json={ 'title': 'Bench post {}'.format(i), 'post_url': 'https://example.com/{}'.format(i) })),
+    ('api.update', lambda c, i: c.put('/api/posts/{}'.format(post_id(i)), json={ 'title': 'Updated title {}'.format(i) })),
+    ('api.comment', lambda c, i: c.post('/api/comments', json={ 'post_id': post_id(i), 'comment_text': 'Bench comment {}'.format(i) })),
+    ('api.upvote', lambda c, i: c.put('/api/posts/upvote', json={ 'post_id': post_id(i) })),
+    ('api.create_batch', lambda c, i: c.post('/api/posts/batch', json=[
+      { 'title': 'Batch post {}-{}'.format(i, n), 'post_url': 'https://example.com/{}/{}'.format(i, n) } for n in range(50)
+    ])),
+    ('api.comment_batch', lambda c, i: c.post('/api/comments/batch', json=[
+      { 'post_id': post_id(i * 50 + n), 'comment_text': 'Batch comment {}'.format(n) } for n in range(50)
+    ])),
+    ('api.upvote_batch', lambda c, i: c.put('/api/posts/upvote/batch', json=[
+      { 'post_id': post_id(i * 50 + n) } for n in range(50)
+    ])),
+    # deletes walk down from the newest seeded post, so they never run out of posts to delete before the other routes are done
+    ('api.delete', lambda c, i: c.delete('/api/posts/{}'.format(last_post - i))),
+  ]
+
+def login(client, user_id=1):
+  with client.session_transaction() as session:
+    session['user_id'] = user_id
+    session['loggedIn'] = True
+
+def run(args):
+  # app.db creates its engine from DB_URL at import time, so the URL has to be in place before anything from the app is imported
+  if not args.db_url:
+    args.db_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='newsfeed-bench-'), 'bench.db')
+  os.environ['DB_URL'] = args.db_url
+
+  from sqlalchemy import event
+  from app import create_app
+  from app.db import engine
+  import seeds
+
+  seeds.seed(
+    engine,
+    users=args.users,
+    posts=args.posts,
+    comments=args.comments,
+    votes=args.votes,
+    rounds=args.rounds
+  )
+
+  # the benchmark makes thousands of writes as one user, one at a time, so the write rate limit would only get in the way
+  app = create_app({
+    'HOT_DECAY_INTERVAL': 0,
+    'BCRYPT_ROUNDS': args.rounds,
+    'WRITE_RATE': None
+  })
+
+  statements = [0]
+
+  @event.listens_for(engine, 'before_cursor_execute')
+  def count_statement(*args):
+    statements[0] += 1
+
+  selected = set(args.routes.split(',')) if args.routes else None
+  results = {}
+
+  for name, request in scenarios(1, args.posts):
+    if selected and name not in selected:
+      continue
+
+    client = app.test_client()
+    login(client)
+
+    latencies = []
+    queries = []
+    errors = 0
+
+    for i in range(args.warmup + args.requests):
+      # the auth routes clear the session, so log back in before every request
+      if name in ('api.login', 'api.logout', 'api.signup'):
+        login(client)
+
+      statements[0] = 0
+      start = time.perf_counter()
+      response = request(client, i)
+      # streamed responses only run their queries as the body is read, so read it inside the measurement
+      response.get_data()
+      elapsed = time.perf_counter() - start
+
+      if i < args.warmup:
+        continue
+
+      latencies.append(elapsed)
+      queries.append(statements[0])
+      if response.status_code >= 400:
+        errors += 1
+
+    total = sum(latencies)
+    results[name] = {
+      'requests': len(latencies),
+      'errors': errors,
+      'throughput': len(latencies) / total if total else 0.0,
+      'p50_ms': percentile(latencies, 50) * 1000,
+      'p95_ms': percentile(latencies, 95) * 1000,
+      'p99_ms': percentile(latencies, 99) * 1000,
+      'queries_avg': sum(queries) / len(queries) if queries else 0.0,
+      'queries_max': max(queries) if queries else 0
+    }
+
+  return results
+
+def report(results, out=sys.stdout):
+  header = '{:<26} {:>9} {:>7} {:>9} {:>9} {:>9} {:>8} {:>8}'.format(
+    'route', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'q avg', 'q max'
+  )
+  print(header, file=out)
+  print('-' * len(header), file=out)
+
+  for name, result in results.items():
+    print('{:<26} {:>9.1f} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.1f} {:>8}'.format(
+      name, result['throughput'], result['errors'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+      result['queries_avg'], result['queries_max']
+    ), file=out)
+
+# returns a list of human-readable regressions, empty when everything is within bounds
+def compare(results, baseline, tolerance):
+  regressions = []
+
+  for name, result in results.items():
+    before = baseline.get(name)
+    if before is None:
+      continue
+
+    if result['queries_max'] > before['queries_max']:
+      regressions.append('{}: {} SQL statements per request, baseline {}'.format(name, result['queries_max'], before['queries_max']))
+
+    if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+      regressions.append('{}: p95 {:.2f} ms, baseline {:.2f} ms'.format(name, result['p95_ms'], before['p95_ms']))
+
+    if result['errors'] > before['errors']:
+      regressions.append('{}: {} errors, baseline {}'.format(name, result['errors'], before['errors']))
+
+  return regressions
+
+def main(argv=None):
+  args = parse_args(argv)
+  results = run(args)
+  report(results)
+
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f), args.tolerance)
+
+    if regressions:
+      print('\nRegressions against {}:'.format(args.baseline))
+      for regression in regressions:
+        print('  ' + regression)
+      sys.exit(1)
+
+    print('\nNo regressions against {}'.format(args.baseline))
+
+if __name__ == '__main__':
+  main()
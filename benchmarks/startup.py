@@ -0,0 +1,127 @@
+# Startup profile: how long a fresh worker process takes to import the app, build it with create_app() and answer its first request,
+# measured in new interpreters (so nothing is already imported or connected) and reported as the median of --runs runs,
+# with and without DB_CREATE_ALL. Also lists the imports that take the longest, from `python -X importtime`.
+#
+#   python -m benchmarks.startup                      # SQLite in a temp dir
+#   python -m benchmarks.startup --runs 10 --path /post/1
+#
+# Run from the repository root; nothing but SQLite is needed.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# runs in the child interpreter and prints its timings as JSON
+CHILD = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app({ 'HOT_DECAY_INTERVAL': 0 })
+created = time.perf_counter()
+response = flask_app.test_client().get(PATH)
+response.get_data()
+first = time.perf_counter()
+response = flask_app.test_client().get(PATH)
+response.get_data()
+second = time.perf_counter()
+print(json.dumps({
+  'import_ms': (imported - start) * 1000,
+  'create_app_ms': (created - imported) * 1000,
+  'first_request_ms': (first - created) * 1000,
+  'second_request_ms': (second - first) * 1000,
+  'status': response.status_code
+}))
+'''
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description='Profile how fast a new worker process starts.')
+  parser.add_argument('--db-url', help='database to start against (defaults to a freshly seeded SQLite file in a temp dir)')
+  parser.add_argument('--runs', type=int, default=5, help='fresh processes per mode')
+  parser.add_argument('--path', default='/', help='the first request to time')
+  parser.add_argument('--imports', type=int, default=15, help='slowest imports to list')
+
+  return parser.parse_args(argv)
+
+def child_env(args, create_all):
+  env = dict(os.environ, DB_URL=args.db_url, DB_CREATE_ALL='1' if create_all else '0')
+  env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+
+  return env
+
+def measure(args, create_all):
+  code = CHILD.replace('PATH', json.dumps(args.path))
+  runs = []
+
+  for _ in range(args.runs):
+    output = subprocess.run(
+      [sys.executable, '-c', code], env=child_env(args, create_all), capture_output=True, text=True, check=True
+    ).stdout
+    runs.append(json.loads(output.strip().splitlines()[-1]))
+
+  keys = ['import_ms', 'create_app_ms', 'first_request_ms', 'second_request_ms']
+  result = { key: statistics.median(run[key] for run in runs) for key in keys }
+  result['total_ms'] = result['import_ms'] + result['create_app_ms'] + result['first_request_ms']
+  result['status'] = runs[-1]['status']
+
+  return result
+
+# the modules with the most cumulative import time, from the importtime log of one `import app`
+def slowest_imports(args, limit):
+  stderr = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', 'import app'], env=child_env(args, False), capture_output=True, text=True, check=True
+  ).stderr
+  imports = []
+
+  for line in stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+
+    own, cumulative, name = line[len('import time:'):].split('|')
+    # only top-level packages and the app's own modules, so a package isn't listed again for every submodule
+    name = name.strip()
+    if '.' not in name or name.startswith('app.'):
+      imports.append((int(cumulative) / 1000, int(own) / 1000, name))
+
+  return sorted(imports, reverse=True)[:limit]
+
+def run(args):
+  if not args.db_url:
+    args.db_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='newsfeed-startup-'), 'startup.db')
+    os.environ['DB_URL'] = args.db_url
+
+    import seeds
+    from sqlalchemy import create_engine
+
+    seeds.seed(create_engine(args.db_url), users=100, posts=500, comments=2000, votes=5000, rounds=4)
+
+  return {
+    'modes': { 'DB_CREATE_ALL=1': measure(args, True), 'DB_CREATE_ALL=0': measure(args, False) },
+    'imports': slowest_imports(args, args.imports)
+  }
+
+def report(results, path, out=sys.stdout):
+  header = '{:<16} {:>10} {:>12} {:>12} {:>12} {:>10}'.format('mode', 'import ms', 'create ms', 'first ms', 'second ms', 'total ms')
+  print(header, file=out)
+  print('-' * len(header), file=out)
+
+  for mode, result in results['modes'].items():
+    print('{:<16} {:>10.1f} {:>12.1f} {:>12.1f} {:>12.1f} {:>10.1f}'.format(
+      mode, result['import_ms'], result['create_app_ms'], result['first_request_ms'], result['second_request_ms'], result['total_ms']
+    ), file=out)
+
+  print('\nfirst request: GET {} (total = import + create_app + first request)'.format(path), file=out)
+  print('\n{:<40} {:>14} {:>10}'.format('slowest imports', 'cumulative ms', 'self ms'), file=out)
+
+  for cumulative, own, name in results['imports']:
+    print('{:<40} {:>14.1f} {:>10.1f}'.format(name, cumulative, own), file=out)
+
+def main(argv=None):
+  args = parse_args(argv)
+  report(run(args), args.path)
+
+if __name__ == '__main__':
+  main()
@@ -1,60 +1,211 @@
-from app.models import User, Post, Comment, Vote
-from app.db import Session, Base, engine
-
-# uses the Base class together with the engine connection variable to do two things: drop and rebuild tables
-Base.metadata.drop_all(engine)
-Base.metadata.create_all(engine)
-
-# Anytime we want to perform a CRUD operation using SQLAlchemy, we need to establish a temporary session connection with the Session class.
-db = Session()
-
-# Within this db session object, we use the add_all() method and the User model to create several new users.
-# insert users
-db.add_all([
-  User(username='alesmonde0', email='nwestnedge0@cbc.ca', password='password123'),
-  User(username='jwilloughway1', email='rmebes1@sogou.com', password='password123'),
-  User(username='iboddam2', email='cstoneman2@last.fm', password='password123'),
-  User(username='dstanmer3', email='ihellier3@goo.ne.jp', password='password123'),
-  User(username='djiri4', email='gmidgley4@weather.com', password='password123')
-])
-
-db.commit()
-# Note that db.add_all() alone doesn't change the database. In fact, it only preps the SQL queries. To run the INSERT statements, you need to call db.commit(). 
-# If you don't need to make any other database transactions at this time, you can close the session connection by calling db.close().
-
-# insert posts
-# important to run this add_all() method after creating the users, because the Post model requires valid user_id fields
-# also need to run db.commit() again to confirm these latest insertions in the database
-db.add_all([
-  Post(title='Donec posuere metus vitae ipsum', post_url='https://buzzfeed.com/in/imperdiet/et/commodo/vulputate.png', user_id=1),
-  Post(title='Morbi non quam nec dui luctus rutrum', post_url='https://nasa.gov/donec.json', user_id=1),
-  Post(title='Donec diam neque, vestibulum eget, vulputate ut, ultrices vel, augue', post_url='https://europa.eu/parturient/montes/nascetur/ridiculus/mus/etiam/vel.aspx', user_id=2),
-  Post(title='Nunc purus', post_url='http://desdev.cn/enim/blandit/mi.jpg', user_id=3),
-  Post(title='Pellentesque eget nunc', post_url='http://google.ca/nam/nulla/integer.aspx', user_id=4)
-])
-
-db.commit()
-
-# insert comments
-db.add_all([
-  Comment(comment_text='Nunc rhoncus dui vel sem.', user_id=1, post_id=2),
-  Comment(comment_text='Morbi odio odio, elementum eu, interdum eu, tincidunt in, leo. Maecenas pulvinar lobortis est.', user_id=1, post_id=3),
-  Comment(comment_text='Aliquam erat volutpat. In congue.', user_id=2, post_id=1),
-  Comment(comment_text='Quisque arcu libero, rutrum ac, lobortis vel, dapibus at, diam.', user_id=2, post_id=3),
-  Comment(comment_text='In hac habitasse platea dictumst.', user_id=3, post_id=3)
-])
-
-db.commit()
-
-# insert votes
-db.add_all([
-  Vote(user_id=1, post_id=2),
-  Vote(user_id=1, post_id=4),
-  Vote(user_id=2, post_id=4),
-  Vote(user_id=3, post_id=4),
-  Vote(user_id=4, post_id=2)
-])
-
-db.commit()
-
-db.close()
\ No newline at end of file
+# Generates a synthetic dataset of users, posts, comments and votes, at whatever scale we need to reproduce production performance locally.
+#
+#   python seeds.py                                          # small default dataset, in the database at DB_URL
+#   python seeds.py --users 100000 --posts 1000000 --votes 10000000 --comments 2000000
+#   python seeds.py --db-url sqlite:///bench.db --seed 7
+#
+# Everything is drawn from one seeded random generator, so the same arguments always produce the same rows.
+# Rows go in through SQLAlchemy Core as multi-row INSERTs, committed every --chunk-size rows, and every user shares one
+# pre-hashed password, so seeding a million users doesn't mean a million bcrypt hashes.
+# Popularity is skewed the way real feeds are: a few users write most of the posts and a few posts get most of the votes and comments.
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+import bcrypt
+
+WORDS = (
+  'python flask sqlalchemy database index query cache latency release open source rust compiler kernel '
+  'linux browser security privacy startup cloud server network protocol design review testing '
+  'performance memory storage stream async feature bug fix launch guide tutorial benchmark scaling'
+).split()
+
+DOMAINS = [
+  'github.com', 'news.ycombinator.com', 'medium.com', 'nytimes.com', 'arstechnica.com', 'theverge.com',
+  'python.org', 'blog.rust-lang.org', 'lwn.net', 'wikipedia.org', 'youtube.com', 'bbc.co.uk',
+  'nasa.gov', 'europa.eu', 'buzzfeed.com', 'google.ca', 'desdev.cn', 'stackoverflow.com'
+]
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description='Seed the database with a synthetic dataset.')
+  parser.add_argument('--db-url', help='database to seed (defaults to the DB_URL environment variable)')
+  parser.add_argument('--users', type=int, default=100)
+  parser.add_argument('--posts', type=int, default=500)
+  parser.add_argument('--comments', type=int, default=1000)
+  parser.add_argument('--votes', type=int, default=2000)
+  parser.add_argument('--days', type=int, default=30, help='spread post dates over this many days')
+  parser.add_argument('--seed', type=int, default=42, help='random seed; the same seed always produces the same data')
+  parser.add_argument('--chunk-size', type=int, default=10000, help='rows per INSERT and commit')
+  parser.add_argument('--password', default='password123', help='password shared by every seeded user')
+  parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost for the shared password hash')
+  parser.add_argument('--no-reset', action='store_true', help="don't drop and recreate the tables first (they must be empty)")
+
+  return parser.parse_args(argv)
+
+# picks an index in range(n), heavily biased toward the low end: index 0 is the most popular user/post, and so on
+def skewed_index(rng, n, skew=3.0):
+  return min(int(n * rng.random() ** skew), n - 1)
+
+# splits `total` across len(weights) buckets in proportion to the weights, capping each bucket at `cap`.
+# Whatever rounding down and the cap leave over is handed out one at a time, largest remainders first, so the buckets add up to `total` when they can
+def distribute(total, weights, cap=None):
+  scale = total / sum(weights) if weights else 0
+  exact = [weight * scale for weight in weights]
+  counts = [int(value) if cap is None else min(int(value), cap) for value in exact]
+
+  leftover = total - sum(counts)
+  order = sorted(range(len(exact)), key=lambda i: exact[i] - int(exact[i]), reverse=True)
+
+  while leftover > 0:
+    handed_out = leftover
+
+    for i in order:
+      if leftover == 0:
+        break
+
+      if cap is None or counts[i] < cap:
+        counts[i] += 1
+        leftover -= 1
+
+    # every bucket is full
+    if leftover == handed_out:
+      break
+
+  return counts
+
+def insert_chunks(engine, table, rows, chunk_size):
+  chunk = []
+
+  for row in rows:
+    chunk.append(row)
+
+    if len(chunk) >= chunk_size:
+      with engine.begin() as conn:
+        conn.execute(table.insert(), chunk)
+      chunk = []
+
+  if chunk:
+    with engine.begin() as conn:
+      conn.execute(table.insert(), chunk)
+
+def seed(engine, users=100, posts=500, comments=1000, votes=2000, days=30, seed=42, chunk_size=10000,
+         password='password123', rounds=12, reset=True, now=None):
+  # the models are imported here rather than at the top of the file, so that main() can point DB_URL at --db-url first
+  from app.db import Base
+  from app.models import User, Post, Comment, Vote
+  from app.utils.ranking import hot_score
+  from app.utils.search import rebuild_index
+  from app.utils.counters import reconcile_users
+  from sqlalchemy.orm import Session
+
+  rng = random.Random(seed)
+  now = now or datetime.now().replace(microsecond=0)
+  start = now - timedelta(days=days)
+
+  # uses the Base class together with the engine connection variable to do two things: drop and rebuild tables
+  if reset:
+    Base.metadata.drop_all(engine)
+  Base.metadata.create_all(engine)
+
+  hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+  insert_chunks(engine, User.__table__, (
+    {
+      'id': i + 1,
+      'username': 'user{}'.format(i + 1),
+      'email': 'user{}@example.com'.format(i + 1),
+      'password': hashed
+    }
+    for i in range(users)
+  ), chunk_size)
+
+  # popularity of each post follows a Pareto distribution (roughly 80/20).
+  # Knowing each post's vote and comment totals up front means its counters and hot score can be written along with the post
+  weights = [rng.paretovariate(1.16) for _ in range(posts)]
+  vote_counts = distribute(votes, weights, cap=users)
+  comment_counts = distribute(comments, weights)
+  created = sorted(start + timedelta(seconds=rng.uniform(0, days * 86400)) for _ in range(posts))
+
+  def post_rows():
+    for i in range(posts):
+      domain = DOMAINS[skewed_index(rng, len(DOMAINS), skew=2.0)]
+
+      yield {
+        'id': i + 1,
+        'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 9))).capitalize()[:100],
+        'post_url': 'https://{}/{}'.format(domain, rng.choice(WORDS)),
+        'domain': domain,
+        'user_id': skewed_index(rng, users) + 1,
+        'created_at': created[i],
+        'updated_at': created[i],
+        'vote_count': vote_counts[i],
+        'comment_count': comment_counts[i],
+        'hot_score': hot_score(vote_counts[i], comment_counts[i], created[i], now)
+      }
+
+  insert_chunks(engine, Post.__table__, post_rows(), chunk_size)
+
+  # each post's voters are a random sample of distinct users, so the (user_id, post_id) pairs are unique without tracking them all in memory
+  def vote_rows():
+    for i in range(posts):
+      for user_index in rng.sample(range(users), vote_counts[i]):
+        yield { 'user_id': user_index + 1, 'post_id': i + 1 }
+
+  insert_chunks(engine, Vote.__table__, vote_rows(), chunk_size)
+
+  def comment_rows():
+    for i in range(posts):
+      for _ in range(comment_counts[i]):
+        created_at = created[i] + timedelta(seconds=rng.uniform(0, 86400))
+
+        yield {
+          'comment_text': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 30)))[:255],
+          'user_id': skewed_index(rng, users) + 1,
+          'post_id': i + 1,
+          'created_at': created_at,
+          'updated_at': created_at
+        }
+
+  insert_chunks(engine, Comment.__table__, comment_rows(), chunk_size)
+
+  # index the generated titles and comments, so search has something to find, and total up each user's dashboard stats
+  db = Session(bind=engine)
+  try:
+    rebuild_index(db)
+    reconcile_users(db, chunk_size)
+  finally:
+    db.close()
+
+  return {
+    'users': users,
+    'posts': posts,
+    'votes': sum(vote_counts),
+    'comments': sum(comment_counts)
+  }
+
+def main(argv=None):
+  args = parse_args(argv)
+
+  if args.db_url:
+    os.environ['DB_URL'] = args.db_url
+
+  from app.db import engine
+
+  totals = seed(
+    engine,
+    users=args.users,
+    posts=args.posts,
+    comments=args.comments,
+    votes=args.votes,
+    days=args.days,
+    seed=args.seed,
+    chunk_size=args.chunk_size,
+    password=args.password,
+    rounds=args.rounds,
+    reset=not args.no_reset
+  )
+
+  print('Seeded {users} users, {posts} posts, {comments} comments and {votes} votes'.format(**totals))
+
+if __name__ == '__main__':
+  main()